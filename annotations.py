@@ -0,0 +1,63 @@
+import os
+from io import StringIO
+from time import time
+
+import numpy as np
+
+from star_writer import column_chunks, write_block
+
+
+def pixel_coordinates(particles):
+    """Pixel coordinates of all particle locations, computed in one pass over the location arrays."""
+    shapes = particles["location/micrograph_shape"]
+    return particles["location/center_x_frac"] * shapes[:, 1], particles["location/center_y_frac"] * shapes[:, 0]
+
+
+def group_by_micrograph(paths):
+    """Yield ``(micrograph_path, indices)`` for each micrograph, keeping the particle order within a micrograph."""
+    unique_paths, inverse = np.unique(np.asarray(paths).astype(str), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(unique_paths) + 1))
+    for i, path in enumerate(unique_paths):
+        yield path, order[bounds[i] : bounds[i + 1]]
+
+
+def coordinates_star(x, y):
+    """STAR file text with rlnCoordinateX/rlnCoordinateY columns, as written by ``star.write``."""
+    text = StringIO()
+    write_block(text, "", column_chunks({"rlnCoordinateX": x, "rlnCoordinateY": y}))
+    return text.getvalue()
+
+
+def write_annotations(job, particles, folder="train_annot/STAR", bin_factor=1):
+    """
+    Write one crYOLO annotation STAR file per micrograph of ``particles`` into ``folder`` of the job, with coordinates
+    scaled to micrographs binned by ``bin_factor``.
+
+    Files are written directly when the job directory is mounted locally and uploaded one by one otherwise.
+    Returns the number of files written.
+    """
+    tic = time()
+    job_dir = str(job.dir())
+    local = os.path.isdir(job_dir)
+    if local:
+        os.makedirs(os.path.join(job_dir, folder), exist_ok=True)
+    else:
+        job.mkdir(folder, parents=True, exist_ok=True)
+
+    x, y = pixel_coordinates(particles)
+    x, y = x / bin_factor, y / bin_factor
+    count = 0
+    for micrograph_path, indices in group_by_micrograph(particles["location/micrograph_path"]):
+        star_file_name = micrograph_path.split("/")[-1].rsplit(".", 1)[0] + ".star"
+        text = coordinates_star(x[indices], y[indices])
+        if local:
+            with open(os.path.join(job_dir, folder, star_file_name), "w") as f:
+                f.write(text)
+        else:
+            job.upload(f"{folder}/{star_file_name}", StringIO(text))
+        count += 1
+
+    job.log(f"Wrote {len(x)} training annotations for {count} micrographs to {folder} ({'local' if local else 'upload'}) in {time() - tic:.1f}s")
+    return count
@@ -0,0 +1,111 @@
+import argparse
+import csv
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from time import sleep, time
+
+import cryosparc.errors
+
+import crYOLO_particlepicker as particlepicker
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description="Run crYOLO particle picking for many projects/workspaces concurrently from a manifest.")
+parser.add_argument(
+    "manifest",
+    type=str,
+    help="CSV file with columns project, workspace, curate_exposures_job_id, box_size, model_path and optionally any crYOLO_particlepicker.py option (e.g. threshold, gpus)",
+)
+parser.add_argument("--workers", type=int, default=4, help="Number of picking jobs to run at the same time (default: 4)")
+parser.add_argument("--jobs_per_gpu", type=int, default=1, help="Number of jobs allowed to predict on one GPU at the same time (default: 1)")
+parser.add_argument("--retries", type=int, default=3, help="Number of retries after transient CryoSPARC API errors (default: 3)")
+parser.add_argument("--retry_delay", type=float, default=30, help="Seconds to wait before retrying (default: 30)")
+
+POSITIONAL = ["project", "workspace", "curate_exposures_job_id", "box_size", "model_path"]
+
+# Errors of failed CryoSPARC requests, with the HTTP status as ``code``: CommandError in cryosparc-tools 4.x, APIError in 5.x
+API_ERRORS = tuple(getattr(cryosparc.errors, name) for name in ("CommandError", "APIError") if hasattr(cryosparc.errors, name))
+# Network failures; those of cryosparc-tools 5.x are httpx transport errors (ConnectError, ReadTimeout, ...)
+NETWORK_ERRORS = (ConnectionError, TimeoutError)
+try:
+    import httpx
+
+    NETWORK_ERRORS += (httpx.TransportError,)
+except ImportError:
+    pass
+
+_gpu_lock = threading.Lock()
+_gpu_semaphores = {}
+
+
+def transient(error):
+    """True for errors worth retrying: CryoSPARC server/network errors rather than bad input or failed jobs."""
+    if isinstance(error, API_ERRORS):
+        return error.code >= 500
+    return isinstance(error, NETWORK_ERRORS)
+
+
+def read_manifest(path):
+    """Parsed crYOLO_particlepicker.py arguments for each row of the manifest."""
+    entries = []
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            argv = [row[name] for name in POSITIONAL]
+            for name, value in row.items():
+                if name not in POSITIONAL and value not in (None, ""):
+                    argv += [f"--{name}", value]
+            entries.append(particlepicker.parser.parse_args(argv))
+    return entries
+
+
+def gpu_slots(jobs_per_gpu):
+    @contextmanager
+    def slots(gpus):
+        with ExitStack() as stack:
+            for gpu in sorted(set(gpus)):
+                with _gpu_lock:
+                    semaphore = _gpu_semaphores.setdefault(gpu, threading.Semaphore(jobs_per_gpu))
+                stack.enter_context(semaphore)
+            yield
+
+    return slots
+
+
+def run_entry(entry, args):
+    result = {"project": entry.project, "curate_job": entry.curate_exposures_job_id, "job": "", "status": "failed", "attempts": 0, "timings": {}}
+    tic = time()
+    while True:
+        result["attempts"] += 1
+        try:
+            job = particlepicker.run(entry, result["timings"], gpu_slots(args.jobs_per_gpu))
+            result["job"], result["status"] = job.uid, "completed"
+            break
+        except Exception as error:
+            result["job"] = entry.resume_job or ""
+            if not transient(error) or result["attempts"] > args.retries:
+                traceback.print_exc()
+                break
+            print(f"{entry.project} {entry.curate_exposures_job_id}: {error}, retrying in {args.retry_delay:.0f}s")
+            sleep(args.retry_delay)
+    result["total"] = time() - tic
+    return result
+
+
+def print_summary(results):
+    stages = []
+    for result in results:
+        stages += [stage for stage in result["timings"] if stage not in stages]
+    header = ["project", "curate_job", "job", "status", "attempts"] + stages + ["total"]
+    rows = [[str(result[name]) for name in header[:5]] + [f"{result['timings'].get(stage, 0):.0f}s" for stage in stages] + [f"{result['total']:.0f}s"] for result in results]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    entries = read_manifest(args.manifest)
+    with ThreadPoolExecutor(args.workers) as pool:
+        results = list(pool.map(lambda entry: run_entry(entry, args), entries))
+    print_summary(results)
@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+from cryosparc import star
+from cryosparc.dataset import Dataset
+from synthetic import PICK_FIELDS, synthetic_locations, synthetic_micrographs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pick_import import fill_picks, index_picks, micrograph_names  # noqa: E402
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description="Benchmark importing crYOLO picks (cryosparc.star records) into a particle output.")
+parser.add_argument("--picks", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 5_000_000], help="Number of picks to benchmark")
+parser.add_argument("--micrographs", type=int, default=10_000, help="Number of micrographs (default: 10000)")
+parser.add_argument("--legacy_max", type=int, default=100_000, help="Also time the per-micrograph masking loop up to this many picks (default: 100000)")
+parser.add_argument("--star_max", type=int, default=1_000_000, help="Also time star.read of the synthetic STAR file up to this many picks (default: 1000000)")
+parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+
+
+class Job:
+    def alloc_output(self, name, alloc=0):
+        return Dataset.allocate(alloc, PICK_FIELDS)
+
+
+def import_picks(job, micrographs, locations, output_name="predicted_particles"):
+    """Allocate ``output_name`` once for all picks in ``locations`` (crYOLO cryosparc.star records) and fill it."""
+    pick_mic, order = index_picks(micrograph_names(micrographs["micrograph_blob/path"]), locations["rlnMicrographName"])
+    predicted = job.alloc_output(output_name, len(order))
+    return fill_picks(predicted, micrographs, locations, pick_mic, order)
+
+
+def legacy_import(job, micrographs, locations):
+    all_predicted = []
+    for mic in micrographs.rows():
+        micrograph_name = mic["micrograph_blob/path"].split("/")[-1]
+        height, width = mic["micrograph_blob/shape"]
+        mask = locations["rlnMicrographName"] == micrograph_name
+        predicted = job.alloc_output("predicted_particles", int(mask.sum()))
+        predicted["location/micrograph_uid"] = mic["uid"]
+        predicted["location/micrograph_path"] = mic["micrograph_blob/path"]
+        predicted["location/micrograph_shape"] = mic["micrograph_blob/shape"]
+        predicted["location/center_x_frac"] = locations[mask]["rlnCoordinateX"] / width
+        predicted["location/center_y_frac"] = locations[mask]["rlnCoordinateY"] / height
+        predicted["pick_stats/ncc_score"] = locations[mask]["rlnAutopickFigureOfMerit"]
+        predicted["pick_stats/power"] = locations[mask]["rlnAutopickFigureOfMerit"]
+        all_predicted.append(predicted)
+    return Dataset.append(*all_predicted)
+
+
+def timed(fn, *fn_args):
+    tic = perf_counter()
+    result = fn(*fn_args)
+    return result, perf_counter() - tic
+
+
+def main(args):
+    job = Job()
+    rng = np.random.default_rng(args.seed)
+    micrographs = synthetic_micrographs(args.micrographs)
+
+    print(f"{'picks':>10} {'import (s)':>12} {'picks/s':>12} {'legacy (s)':>12} {'star.read (s)':>14}")
+    for n in args.picks:
+        locations = synthetic_locations(micrographs, n, rng)
+        predicted, elapsed = timed(import_picks, job, micrographs, locations)
+        assert len(predicted) == n
+
+        legacy = "-"
+        if n <= args.legacy_max:
+            legacy_predicted, legacy_elapsed = timed(legacy_import, job, micrographs, locations)
+            assert np.allclose(legacy_predicted["location/center_x_frac"], predicted["location/center_x_frac"])
+            legacy = f"{legacy_elapsed:.2f}"
+
+        read = "-"
+        if n <= args.star_max:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                star.write(f"{tmpdir}/cryosparc.star", locations)
+                _, read_elapsed = timed(star.read, f"{tmpdir}/cryosparc.star")
+            read = f"{read_elapsed:.2f}"
+
+        print(f"{n:>10} {elapsed:>12.2f} {n / elapsed:>12.0f} {legacy:>12} {read:>14}")
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
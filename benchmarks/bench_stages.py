@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+from fake_cryosparc import FakeCryoSPARC
+from synthetic import (
+    synthetic_locations,
+    synthetic_micrographs,
+    synthetic_particles,
+    synthetic_picks,
+    write_files,
+    write_particles,
+    write_star_picks,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotations import write_annotations  # noqa: E402
+from dedup import deduplicate_job  # noqa: E402
+from export_manifest import stack_entries  # noqa: E402
+from instrumentation import format_table  # noqa: E402
+from pick_store import PICK_STORE_FOLDER, PickStore, PickStoreWriter  # noqa: E402
+from prediction import read_picks  # noqa: E402
+from relion_export import (  # noqa: E402
+    export_star,
+    link_stacks,
+    load_particles,
+    stack_counts,
+)
+from staging import stage_files  # noqa: E402
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description="Time the stages of the scripts on synthetic data against an offline fake CryoSPARC instance.")
+parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000], help="Session sizes to benchmark, in picks/particles, up to 10M (default: 1000 100000 1000000)")
+parser.add_argument("--stages", nargs="+", default=None, help="Stages to run (default: all)")
+parser.add_argument("--picks_per_micrograph", type=int, default=300, help="Picks/particles per micrograph (default: 300)")
+parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per CryoSPARC API call (default: 0)")
+parser.add_argument("--unmounted", action="store_true", help="Make the project directory look remote, so that staging and annotations go through the API")
+parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+parser.add_argument("--json", type=str, help="Write the results to this JSON file")
+parser.add_argument("--baseline", type=str, help="JSON results of an earlier run; stages more than --tolerance slower are reported as regressions")
+parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline (default: 0.25)")
+parser.add_argument("--min_seconds", type=float, default=0.1, help="Ignore slowdowns of stages faster than this (default: 0.1)")
+
+
+# Each benchmark sets up its inputs for a session of ``n`` picks/particles on ``n_micrographs`` micrographs and returns
+# the function to time
+
+
+def bench_staging(project, n_micrographs, n, rng):
+    micrographs = synthetic_micrographs(n_micrographs)
+    write_files(str(project.local_dir), micrographs["micrograph_blob/path"])
+    job = project.create_external_job("W1")
+    return lambda: stage_files(job, project, micrographs["micrograph_blob/path"], "full_data")
+
+
+def bench_pick_import(project, n_micrographs, n, rng):
+    micrographs = synthetic_micrographs(n_micrographs)
+    job = project.create_external_job("W1")
+    job.add_output("particle", "predicted_particles", slots=["location", "pick_stats"])
+    star_path = write_star_picks(os.path.join(str(job.local_dir), "boxfiles", "CRYOSPARC", "cryosparc.star"), synthetic_locations(micrographs, n, rng))
+
+    # The pick store needs the job directory mounted, so it is written locally even with --unmounted
+    store = os.path.join(str(job.local_dir), PICK_STORE_FOLDER)
+
+    def run():
+        with PickStoreWriter(store, micrographs) as pick_store:
+            pick_store.append(read_picks([star_path]))
+        job.save_output("predicted_particles", PickStore(store).to_particles(job, 0.5))
+
+    return run
+
+
+def bench_annotations(project, n_micrographs, n, rng):
+    particles = synthetic_picks(synthetic_micrographs(n_micrographs), n, rng)
+    job = project.create_external_job("W1")
+    return lambda: write_annotations(job, particles, "train_annot/STAR")
+
+
+def bench_dedup(project, n_micrographs, n, rng):
+    particles = synthetic_picks(synthetic_micrographs(n_micrographs), n, rng)
+    job = project.create_external_job("W1")
+    return lambda: deduplicate_job(job, particles, 64)
+
+
+def bench_cs2star(project, n_micrographs, n, rng):
+    particles = synthetic_particles(synthetic_micrographs(n_micrographs), n, rng)
+    write_files(str(project.local_dir), particles["blob/path"])
+    select_job = project.add_job()
+    paths = write_particles(str(select_job.local_dir), select_job.uid, particles)
+    relion_project = str(project.local_dir.parent / "relion")
+    os.makedirs(relion_project)
+
+    def run():
+        state = export_star(load_particles(*paths), os.path.join(relion_project, "particles.star"))
+        stacks = stack_entries(str(project.local_dir), stack_counts(state), relion_project)
+        link_stacks(str(project.local_dir), relion_project, list(stacks))
+
+    return run
+
+
+# Stages and the items they process (staging links the micrographs of the session, the others its picks/particles)
+STAGES = {
+    "staging": (bench_staging, "micrographs"),
+    "pick_import": (bench_pick_import, "picks"),
+    "annotations": (bench_annotations, "picks"),
+    "dedup": (bench_dedup, "picks"),
+    "cs2star": (bench_cs2star, "particles"),
+}
+
+
+def run_stage(name, size, args):
+    """Set up stage ``name`` for a session of ``size`` picks in a fresh fake instance, then time it; returns the result row."""
+    setup, unit = STAGES[name]
+    n_micrographs = max(1, size // args.picks_per_micrograph)
+    items = n_micrographs if unit == "micrographs" else size
+    with tempfile.TemporaryDirectory() as root:
+        cs = FakeCryoSPARC(root, latency=args.latency, mounted=not args.unmounted)
+        project = cs.create_project("P1")
+        stage = setup(project, n_micrographs, size, np.random.default_rng(args.seed))
+        cs.api_log.reset()
+        tic = perf_counter()
+        stage()
+        elapsed = perf_counter() - tic
+        api = cs.api_log.summary()
+    return {
+        "stage": name,
+        "size": size,
+        "items": items,
+        "unit": unit,
+        "seconds": elapsed,
+        "per_second": items / elapsed if elapsed else 0.0,
+        "api_calls": sum(call["calls"] for call in api.values()),
+        "api_seconds": sum(call["seconds"] for call in api.values()),
+        "api_mb": sum(call["mb"] for call in api.values()),
+        "api": api,
+    }
+
+
+def regressions(results, baseline, tolerance, min_seconds=0.0):
+    """
+    ``(row, baseline seconds)`` of the rows of ``results`` more than ``tolerance`` slower than the same stage and size
+    in ``baseline``, ignoring stages that took less than ``min_seconds``.
+    """
+    previous = {(row["stage"], row["size"]): row["seconds"] for row in baseline}
+    slower = []
+    for row in results:
+        seconds = previous.get((row["stage"], row["size"]))
+        if seconds is not None and row["seconds"] >= min_seconds and row["seconds"] > seconds * (1 + tolerance):
+            slower.append((row, seconds))
+    return slower
+
+
+def main(args):
+    results = []
+    for name in args.stages or list(STAGES):
+        for size in args.sizes:
+            results.append(run_stage(name, size, args))
+            row = results[-1]
+            print(f"{name} {row['items']} {row['unit']}: {row['seconds']:.2f}s, {row['api_calls']} API calls", file=sys.stderr)
+
+    columns = ["stage", "size", "items", "unit", "seconds", "per_second", "api_calls", "api_seconds", "api_mb"]
+    print(format_table(columns, [[row[column] for column in columns] for row in results]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")}, "results": results}, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f)["results"], args.tolerance, args.min_seconds)
+        for row, seconds in slower:
+            print(f"Regression: {row['stage']} with {row['items']} {row['unit']} took {row['seconds']:.2f}s (baseline {seconds:.2f}s)")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
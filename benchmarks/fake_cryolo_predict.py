@@ -0,0 +1,36 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from cryosparc import star
+
+# Stand-in for cryolo_predict.py that needs no GPU: writes random picks for every micrograph in the input folder
+# to <output>/CRYOSPARC/cryosparc.star. Use it with the --cryolo_predict option of the crYOLO scripts.
+parser = argparse.ArgumentParser(description="Fake crYOLO prediction writing random picks to a cryosparc.star file.")
+parser.add_argument("-i", "--input", type=str, required=True, help="Folder with micrographs")
+parser.add_argument("-o", "--output", type=str, required=True, help="Output folder")
+parser.add_argument("-g", "--gpu", type=str, default="0", help="GPU (only reported)")
+parser.add_argument("-t", "--threshold", type=float, default=0.3, help="Picks below this confidence are dropped")
+parser.add_argument("--picks", type=int, default=300, help="Picks per micrograph before thresholding (default: 300)")
+parser.add_argument("--shape", type=int, nargs=2, default=[4092, 5760], help="Micrograph height and width (default: 4092 5760)")
+parser.add_argument("--seconds_per_micrograph", type=float, default=0.0, help="Simulated prediction time (default: 0)")
+args, _ = parser.parse_known_args()
+
+names = sorted(name for name in os.listdir(args.input) if not os.path.isdir(os.path.join(args.input, name)))
+rng = np.random.default_rng(abs(hash(args.input)) % 2**32)
+time.sleep(args.seconds_per_micrograph * len(names))
+
+n = len(names) * args.picks
+locations = np.rec.fromarrays(
+    [
+        np.repeat(np.array(names, dtype=object), args.picks),
+        rng.uniform(0, args.shape[1], n),
+        rng.uniform(0, args.shape[0], n),
+        rng.uniform(0, 1, n),
+    ],
+    names=["rlnMicrographName", "rlnCoordinateX", "rlnCoordinateY", "rlnAutopickFigureOfMerit"],
+)
+os.makedirs(os.path.join(args.output, "CRYOSPARC"), exist_ok=True)
+star.write(os.path.join(args.output, "CRYOSPARC", "cryosparc.star"), locations[locations["rlnAutopickFigureOfMerit"] >= args.threshold])
+print(f"GPU {args.gpu}: wrote picks for {len(names)} micrographs to {args.output}")
@@ -0,0 +1,245 @@
+import os
+import shutil
+import subprocess
+import threading
+from collections import defaultdict
+from functools import wraps
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from time import perf_counter, sleep
+
+from cryosparc.dataset import Dataset
+from synthetic import SLOT_FIELDS
+
+# Offline stand-in for the parts of the CryoSPARC / project / job API used by the scripts, backed by a local project
+# directory. Every API method is counted and timed, with an optional simulated round-trip latency per call. With
+# mounted=False, dir() returns a path below a regular file, which does not exist and cannot be created, so the scripts
+# take their API (non-local) paths. Checkpoints and plots are kept in the job's ``logs`` and ``plots``.
+
+
+class ApiLog:
+    """Call count, total seconds and bytes sent per API method, shared by a fake instance and its projects and jobs."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.bytes = defaultdict(int)
+
+    def record(self, name, seconds, sent=0):
+        with self.lock:
+            self.calls[name] += 1
+            self.seconds[name] += seconds
+            self.bytes[name] += sent
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.seconds.clear()
+            self.bytes.clear()
+
+    def summary(self):
+        """``{method: {"calls", "seconds", "mb"}}`` of the calls so far."""
+        with self.lock:
+            return {name: {"calls": self.calls[name], "seconds": self.seconds[name], "mb": self.bytes[name] / 1e6} for name in sorted(self.calls)}
+
+
+def api(method):
+    """Count and time calls of ``method`` in the ``api_log`` of its object, after the simulated latency."""
+
+    @wraps(method)
+    def recorded(self, *args, **kwargs):
+        tic = perf_counter()
+        if self.api_log.latency:
+            sleep(self.api_log.latency)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.api_log.record(method.__name__, perf_counter() - tic)
+
+    return recorded
+
+
+class FakeCryoSPARC:
+    """Fake ``CryoSPARC`` client with its projects in ``root`` (one directory per project UID)."""
+
+    def __init__(self, root, latency=0.0, mounted=True):
+        self.root = root
+        self.mounted = mounted
+        self.api_log = ApiLog(latency)
+        self.projects = {}
+        if not mounted:
+            open(os.path.join(root, "unmounted"), "w").close()
+
+    def create_project(self, uid="P1"):
+        """Set up project ``uid`` (not an API call; projects are created by the benchmark)."""
+        os.makedirs(os.path.join(self.root, uid), exist_ok=True)
+        self.projects[uid] = FakeProject(self, uid)
+        return self.projects[uid]
+
+    @api
+    def find_project(self, project_uid):
+        return self.projects[project_uid]
+
+
+class FakeProject:
+    def __init__(self, cs, uid):
+        self.cs = cs
+        self.uid = uid
+        self.api_log = cs.api_log
+        self.jobs = {}
+        self.outputs = {}
+
+    @property
+    def local_dir(self):
+        return Path(self.cs.root) / self.uid
+
+    def dir(self):
+        return self.local_dir if self.cs.mounted else Path(self.cs.root) / "unmounted" / self.uid
+
+    def next_uid(self):
+        """First ``J<n>`` not taken by another job of the project."""
+        n = len(self.jobs) + 1
+        while f"J{n}" in self.jobs:
+            n += 1
+        return f"J{n}"
+
+    def add_job(self, uid=None, outputs=None, status="completed"):
+        """Add a job with saved ``outputs`` (dict of name to Dataset), e.g. an upstream job (not an API call)."""
+        job = FakeJob(self, uid or self.next_uid(), status)
+        for name, dataset in (outputs or {}).items():
+            self.outputs[(job.uid, name)] = dataset
+        return job
+
+    @api
+    def create_external_job(self, workspace_uid, title=None, desc=None):
+        return FakeJob(self, self.next_uid(), "building", title)
+
+    @api
+    def find_job(self, job_uid):
+        return self.jobs[job_uid]
+
+    @api
+    def find_external_job(self, job_uid):
+        return self.jobs[job_uid]
+
+    @api
+    def symlink(self, source_path_rel, target_path_rel):
+        target = self.local_dir / target_path_rel
+        os.symlink(os.path.relpath(self.local_dir / source_path_rel, target.parent), target)
+
+
+class FakeJob:
+    def __init__(self, project, uid, status="building", title=None):
+        self.project = project
+        self.uid = uid
+        self.status = status
+        self.title = title
+        self.api_log = project.api_log
+        self.inputs = defaultdict(list)
+        self.output_slots = {}
+        self.logs = []
+        self.plots = []
+        project.jobs[uid] = self
+        os.makedirs(self.local_dir, exist_ok=True)
+
+    @property
+    def local_dir(self):
+        return self.project.local_dir / self.uid
+
+    def dir(self):
+        return self.project.dir() / self.uid
+
+    @api
+    def refresh(self):
+        return self
+
+    @api
+    def start(self, status="waiting"):
+        self.status = status
+
+    @api
+    def stop(self, error=False):
+        self.status = "failed" if error else "completed"
+
+    @api
+    def log(self, text, level="text"):
+        self.logs.append(text)
+
+    @api
+    def log_checkpoint(self, meta=None):
+        self.logs.append("checkpoint")
+
+    @api
+    def log_plot(self, figure, text, formats=("png", "pdf"), raw_data=None, raw_data_file=None, raw_data_format=None, flags=("plots",), savefig_kw=None):
+        self.plots.append((str(figure), text))
+        self.logs.append(text)
+
+    @api
+    def connect(self, target_input, source_job_uid, source_output, slots=None, title=""):
+        self.inputs[target_input].append((source_job_uid, source_output))
+        return True
+
+    @api
+    def add_output(self, type, name=None, slots=None, passthrough=None, title=None, alloc=None):
+        self.output_slots[name] = [slot if isinstance(slot, str) else slot["name"] for slot in slots or []]
+        return name
+
+    @api
+    def load_input(self, name, slots=None):
+        datasets = [self.project.outputs[source] for source in self.inputs[name]]
+        return Dataset.append(*datasets) if len(datasets) > 1 else datasets[0].copy()
+
+    @api
+    def load_output(self, name, slots=None):
+        return self.project.outputs[(self.uid, name)]
+
+    @api
+    def alloc_output(self, name, alloc=0):
+        fields = sum((SLOT_FIELDS[slot] for slot in self.output_slots[name]), [])
+        if isinstance(alloc, int):
+            return Dataset.allocate(alloc, fields)
+        return Dataset({"uid": alloc["uid"] if isinstance(alloc, Dataset) else alloc}).add_fields(fields)
+
+    def save_output(self, name, dataset, refresh=True):
+        # Serialized like the real upload, so the recorded time and size include encoding the dataset
+        tic = perf_counter()
+        if self.api_log.latency:
+            sleep(self.api_log.latency)
+        data = BytesIO()
+        dataset.save(data)
+        self.project.outputs[(self.uid, name)] = dataset
+        self.api_log.record("save_output", perf_counter() - tic, data.tell())
+
+    @api
+    def mkdir(self, target_path_rel, parents=False, exist_ok=False):
+        (self.local_dir / target_path_rel).mkdir(parents=parents, exist_ok=exist_ok)
+
+    @api
+    def list_files(self, prefix="", recursive=False):
+        folder = self.local_dir / prefix
+        return [str(PurePosixPath(prefix) / name) for name in os.listdir(folder)] if folder.is_dir() else []
+
+    def upload(self, target_path_rel, source, overwrite=False):
+        tic = perf_counter()
+        if self.api_log.latency:
+            sleep(self.api_log.latency)
+        target = self.local_dir / target_path_rel
+        if isinstance(source, (str, os.PathLike)):
+            shutil.copyfile(source, target)
+        else:
+            data = source.read() if hasattr(source, "read") else source
+            with open(target, "wb") as f:
+                f.write(data.encode() if isinstance(data, str) else data)
+        self.api_log.record("upload", perf_counter() - tic, os.path.getsize(target))
+
+    @api
+    def subprocess(self, args, mute=False, checkpoint=False, checkpoint_line_pattern=None, **kwargs):
+        cwd = kwargs.pop("cwd", None)
+        cwd = self.local_dir / os.path.relpath(cwd, self.dir()) if cwd is not None else None
+        result = subprocess.run(args, cwd=cwd, capture_output=True, text=True, **kwargs)
+        if not mute:
+            self.logs.extend(result.stdout.splitlines())
+        if result.returncode:
+            raise RuntimeError(f"Subprocess exited with status {result.returncode} ({args})")
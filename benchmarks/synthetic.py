@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+from cryosparc import star
+from cryosparc.dataset import Dataset
+
+# Synthetic CryoSPARC datasets and crYOLO outputs for the benchmarks, shaped like those of a real session
+MICROGRAPH_SHAPE = (4092, 5760)
+SLOT_FIELDS = {
+    "location": [
+        ("location/micrograph_uid", "<u8"),
+        ("location/exp_group_id", "<u4"),
+        ("location/micrograph_path", "O"),
+        ("location/micrograph_shape", "<u4", (2,)),
+        ("location/micrograph_psize_A", "<f4"),
+        ("location/center_x_frac", "<f4"),
+        ("location/center_y_frac", "<f4"),
+    ],
+    "pick_stats": [
+        ("pick_stats/ncc_score", "<f4"),
+        ("pick_stats/power", "<f4"),
+        ("pick_stats/template_idx", "<u4"),
+        ("pick_stats/angle_rad", "<f4"),
+    ],
+    "blob": [
+        ("blob/path", "O"),
+        ("blob/idx", "<u4"),
+        ("blob/shape", "<u4", (2,)),
+        ("blob/psize_A", "<f4"),
+        ("blob/sign", "<f4"),
+    ],
+    "ctf": [
+        ("ctf/exp_group_id", "<u4"),
+        ("ctf/accel_kv", "<f4"),
+        ("ctf/cs_mm", "<f4"),
+        ("ctf/amp_contrast", "<f4"),
+        ("ctf/df1_A", "<f4"),
+        ("ctf/df2_A", "<f4"),
+        ("ctf/df_angle_rad", "<f4"),
+        ("ctf/phase_shift_rad", "<f4"),
+    ],
+    "alignments2D": [("alignments2D/class", "<u4")],
+    "alignments3D": [("alignments3D/pose", "<f4", (3,)), ("alignments3D/shift", "<f4", (2,))],
+    "series": [("series/path", "O"), ("series/idx", "<u4"), ("series/series_length", "<u4"), ("series/psize_A", "<f4")],
+}
+PICK_FIELDS = SLOT_FIELDS["location"] + SLOT_FIELDS["pick_stats"]
+
+
+def micrograph_paths(n, job_uid="J2"):
+    return np.array([f"{job_uid}/motioncorrected/{i:06d}_mic_patch_aligned_doseweighted.mrc" for i in range(n)], dtype=object)
+
+
+def synthetic_micrographs(n):
+    """Micrographs dataset (``micrograph_blob`` slot) of ``n`` motion corrected micrographs."""
+    micrographs = Dataset.allocate(n, [("micrograph_blob/path", "O"), ("micrograph_blob/shape", "<u4", (2,))])
+    micrographs["micrograph_blob/path"] = micrograph_paths(n)
+    micrographs["micrograph_blob/shape"] = MICROGRAPH_SHAPE
+    return micrographs
+
+
+def write_files(project_dir, paths, size=0):
+    """Create the files ``paths`` (relative to the project directory, e.g. micrographs or stacks) of ``size`` bytes."""
+    for path in np.unique(np.asarray(paths).astype(str)):
+        os.makedirs(os.path.join(project_dir, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(project_dir, path), "wb") as f:
+            f.truncate(size)
+
+
+def synthetic_locations(micrographs, n, rng):
+    """``n`` crYOLO picks (cryosparc.star records) spread randomly over ``micrographs``, sorted by micrograph."""
+    names = np.array([path.split("/")[-1] for path in micrographs["micrograph_blob/path"]], dtype=object)
+    mic = np.sort(rng.integers(0, len(names), n))
+    return np.rec.fromarrays(
+        [rng.uniform(0, MICROGRAPH_SHAPE[1], n), rng.uniform(0, MICROGRAPH_SHAPE[0], n), names[mic], rng.uniform(0, 1, n)],
+        names=["rlnCoordinateX", "rlnCoordinateY", "rlnMicrographName", "rlnAutopickFigureOfMerit"],
+    )
+
+
+def write_star_picks(path, locations):
+    """Write picks to a ``cryosparc.star`` file as crYOLO does."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    star.write(path, locations)
+    return path
+
+
+def synthetic_picks(micrographs, n, rng):
+    """Particle picks dataset (``location`` and ``pick_stats`` slots) of ``n`` picks on ``micrographs``."""
+    mic = np.sort(rng.integers(0, len(micrographs), n))
+    picks = Dataset.allocate(n, PICK_FIELDS)
+    picks["location/micrograph_uid"] = micrographs["uid"][mic]
+    picks["location/micrograph_path"] = micrographs["micrograph_blob/path"][mic]
+    picks["location/micrograph_shape"] = micrographs["micrograph_blob/shape"][mic]
+    picks["location/micrograph_psize_A"] = 0.83
+    picks["location/center_x_frac"] = rng.uniform(0, 1, n)
+    picks["location/center_y_frac"] = rng.uniform(0, 1, n)
+    picks["pick_stats/ncc_score"] = rng.uniform(0, 1, n)
+    picks["pick_stats/power"] = picks["pick_stats/ncc_score"]
+    return picks
+
+
+def synthetic_particles(micrographs, n, rng, box_size=256, stack_size=300, job_uid="J10"):
+    """
+    Extracted particles dataset of ``n`` particles on ``micrographs``, with ``blob``, ``ctf``, ``location``,
+    ``alignments2D`` and ``alignments3D`` slots, ``stack_size`` particles per stack in ``job_uid``.
+    """
+    particles = synthetic_picks(micrographs, n, rng).add_fields(sum((SLOT_FIELDS[slot] for slot in ["blob", "ctf", "alignments2D", "alignments3D"]), []))
+    stacks = np.arange(n) // stack_size
+    particles["blob/path"] = np.array([f"{job_uid}/extract/{i:06d}_particles.mrc" for i in range(stacks[-1] + 1 if n else 0)], dtype=object)[stacks]
+    particles["blob/idx"] = np.arange(n) % stack_size
+    particles["blob/shape"] = box_size
+    particles["blob/psize_A"] = 0.83
+    particles["blob/sign"] = -1
+    particles["ctf/accel_kv"] = 300
+    particles["ctf/cs_mm"] = 2.7
+    particles["ctf/amp_contrast"] = 0.1
+    particles["ctf/df1_A"] = rng.uniform(5000, 25000, n)
+    particles["ctf/df2_A"] = particles["ctf/df1_A"] + rng.uniform(0, 500, n)
+    particles["ctf/df_angle_rad"] = rng.uniform(0, np.pi, n)
+    particles["alignments2D/class"] = rng.integers(0, 50, n)
+    particles["alignments3D/pose"] = rng.normal(0, 1, (n, 3))
+    particles["alignments3D/shift"] = rng.normal(0, 2, (n, 2))
+    return particles
+
+
+def write_particles(job_dir, job_uid, particles, output="particles_selected"):
+    """
+    Write ``particles`` as a CryoSPARC job does: ``<output>.cs`` with the ``blob`` and alignment fields and
+    ``<job_uid>_passthrough_<output>.cs`` with the others, both in NumPy format. Returns both paths.
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    fields = particles.fields()
+    own = ["uid"] + [field for field in fields if field.split("/")[0] in ("blob", "alignments2D", "alignments3D")]
+    passthrough = ["uid"] + [field for field in fields if field not in own]
+    paths = (os.path.join(job_dir, f"{output}.cs"), os.path.join(job_dir, f"{job_uid}_passthrough_{output}.cs"))
+    particles.filter_fields(own, copy=True).save(paths[0])
+    particles.filter_fields(passthrough, copy=True).save(paths[1])
+    return paths
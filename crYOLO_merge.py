@@ -0,0 +1,68 @@
+import argparse
+
+from dedup import deduplicate_job
+from instrumentation import Profile
+from job_wait import wait_for_jobs
+from session import connect, find_job, find_project
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description="Merge the picks of several crYOLO jobs within CryoSPARC, removing duplicate picks.")
+parser.add_argument("project", type=str, help="Name of project to run the job in")
+parser.add_argument("workspace", type=str, help="Name of workspace to run the job in")
+parser.add_argument("box_size", type=int, help="Box size used for particle picking (in pixels of the micrographs)")
+parser.add_argument("cryolo_job_ids", type=str, nargs="+", help="IDs of the crYOLO picking jobs to merge")
+parser.add_argument("--title", type=str, default="crYOLO merged picks", help='Title for job (default: "crYOLO merged picks")')
+parser.add_argument(
+    "--min_distance",
+    type=float,
+    default=0.5,
+    help="Picks on the same micrograph closer than this fraction of the box size are duplicates; the one with the highest crYOLO score is kept (default: 0.5)",
+)
+parser.add_argument("--baseport", type=str, default=39000, help="Cryosparc baseport (default: 39000)")
+
+
+def run(args):
+    """Merge and deduplicate the picks of crYOLO jobs for parsed command line ``args``; returns the new external job."""
+    profile = Profile("crYOLO_merge")
+
+    # Connect to CryoSPARC instance (login credentials from .env file, reused within a process)
+    profile.begin("setup")
+    cs = connect(args.baseport)
+
+    # Find project and create job
+    project = find_project(cs, args.project)
+    job = project.create_external_job(args.workspace, title=args.title)
+    cryolo_jobs = [find_job(project, job_id) for job_id in args.cryolo_job_ids]
+
+    # Connect the picks of all jobs to one input and add output
+    for job_id in args.cryolo_job_ids:
+        job.connect("picks", job_id, "predicted_particles", slots=["location", "pick_stats"])
+    job.add_output("particle", "predicted_particles", slots=["location", "pick_stats"])
+
+    # Wait for the crYOLO jobs to finish
+    job.start(status="waiting")
+    job.log(f"Waiting for jobs {', '.join(args.cryolo_job_ids)} to finish.")
+    profile.begin("wait")
+    wait_for_jobs(job, cryolo_jobs)
+    job.stop()
+
+    # Start the job and set its status to "running"
+    job.log(f"Starting job - {job.uid}")
+    job.start(status="running")
+
+    # Keep the best scoring pick of every group of picks closer than the minimum distance
+    profile.begin("load")
+    picks = job.load_input("picks", ["location", "pick_stats"])
+    profile.begin("dedup")
+    merged = deduplicate_job(job, picks, args.min_distance * args.box_size)
+
+    # Save particle locations and stop job
+    profile.begin("save")
+    job.save_output("predicted_particles", merged)
+    profile.write(str(job.dir()), job)
+    job.stop()
+    return job
+
+
+if __name__ == "__main__":
+    run(parser.parse_args())
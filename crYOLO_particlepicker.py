@@ -1,9 +1,15 @@
 import argparse
-
-from cryosparc import star
-from cryosparc.dataset import Dataset
-from cryosparc.tools import CryoSPARC
-from dotenv import dotenv_values
+import json
+from contextlib import nullcontext
+
+from filter_cache import FilterCache
+from instrumentation import Profile
+from job_wait import wait_for_jobs
+from pick_import import micrograph_names
+from pick_store import PickStore, PickStoreWriter, pick_store_path
+from prediction import predict_on_gpus, read_picks, split_chunks, stream_predictions
+from session import connect, find_job, find_project
+from staging import stage_files
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description="Run crYOLO particle picking on a set of micrographs within CryoSPARC.")
@@ -28,95 +34,147 @@ parser.add_argument(
 )
 parser.add_argument("--predict_batch", type=int, default=3, help="prediction batch (default: 3)")
 parser.add_argument("--baseport", type=str, default=39000, help="Cryosparc baseport (default: 39000)")
-args = parser.parse_args()
-
-# Load login credentials from .env file
-env_vars = dotenv_values(".env")
-license = env_vars["CRYOSPARC_LICENSE_ID"]
-host = env_vars["CRYOSPARC_HOST"]
-email = env_vars["CRYOSPARC_EMAIL"]
-password = env_vars["CRYOSPARC_PASSWORD"]
-
-# Connect to CryoSPARC instance
-cs = CryoSPARC(license=license, host=host, base_port=args.baseport, email=email, password=password)
-
-# Find project and create job
-project = cs.find_project(args.project)
-job = project.create_external_job(args.workspace, title=args.title)
-curate_job = project.find_job(args.curate_exposures_job_id)
-
-# Connect micrographs to the job and add output
-job.connect(
-    "all_micrographs",
-    args.curate_exposures_job_id,
-    "exposures_accepted",
-    slots=["micrograph_blob"],
+parser.add_argument(
+    "--chunk_size",
+    type=int,
+    default=0,
+    help="Predict micrographs in chunks of this size and save picks after each chunk (default: 0, predict all at once)",
 )
-job.add_output("particle", "predicted_particles", slots=["location", "pick_stats"])
-
-# Wait for all previous jobs to finish
-job.start(status="waiting")
-job.log(f"Waiting for job {args.curate_exposures_job_id} to finish.")
-curate_job.wait_for_status(status="completed")
-job.stop()
-
-# Start the job and set its status to "running"
-job.log(f"Starting job - {job.uid}")
-job.start(status="running")
-
-# Create directory and symlink the micrographs
-job.mkdir("full_data")
-all_micrographs = job.load_input("all_micrographs", ["micrograph_blob"])
-for mic in all_micrographs.rows():
-    source = mic["micrograph_blob/path"]
-    target = job.uid + "/full_data/" + source.split("/")[-1]
-    project.symlink(source, target)
-
-# Configure crYOLO
-job.subprocess(
-    f"cryolo_gui.py config config_cryolo.json {args.box_size} --filter LOWPASS --low_pass_cutoff {args.lowpass}".split(" "),
-    cwd=job.dir(),
-    mute=True,
-    checkpoint=True,
+parser.add_argument(
+    "--predict_threshold",
+    type=float,
+    help="Lower threshold to run crYOLO prediction with; all picks above it are kept in the picks store of the job for crYOLO_repick.py (default: same as --threshold)",
 )
-
-# Run particle picking job
-job.subprocess(
-    f"cryolo_predict.py -c config_cryolo.json -w {args.model_path} -i full_data -g 0 -o boxfiles -t {args.threshold} -pbs {args.predict_batch}".split(" "),
-    cwd=job.dir(),
-    mute=True,
-    checkpoint=True,
+parser.add_argument("--gpus", type=str, default="0", help="Comma separated GPUs to shard prediction over, e.g. 0,1,2,3 (default: 0)")
+parser.add_argument("--cryolo_predict", type=str, default="cryolo_predict.py", help="crYOLO prediction command (default: cryolo_predict.py)")
+parser.add_argument(
+    "--filter_cache_gb",
+    type=float,
+    default=0,
+    help="Reuse low pass filtered micrographs across crYOLO jobs in the project, keeping at most this many GB (default: 0, no cache)",
 )
-
-# Fill CrYOLO threshold as NCC and power score so that the results may be inspected and filtered with an Inspect Picks job.
-output_star_folder = "STAR"
-all_predicted = []
-
-starfile_path = "boxfiles/CRYOSPARC/cryosparc.star"
-locations = star.read(job.dir() / starfile_path)[""]
-
-for mic in all_micrographs.rows():
-    micrograph_path = mic["micrograph_blob/path"]
-    micrograph_name = micrograph_path.split("/")[-1]
-    height, width = mic["micrograph_blob/shape"]
-
-    center_x = locations[locations["rlnMicrographName"] == micrograph_name]["rlnCoordinateX"] / width
-    center_y = locations[locations["rlnMicrographName"] == micrograph_name]["rlnCoordinateY"] / height
-    threshold = locations[locations["rlnMicrographName"] == micrograph_name]["rlnAutopickFigureOfMerit"]
-
-    predicted = job.alloc_output(
-        "predicted_particles",
-        len(locations[locations["rlnMicrographName"] == micrograph_name]),
-    )
-    predicted["location/micrograph_uid"] = mic["uid"]
-    predicted["location/micrograph_path"] = mic["micrograph_blob/path"]
-    predicted["location/micrograph_shape"] = mic["micrograph_blob/shape"]
-    predicted["location/center_x_frac"] = center_x
-    predicted["location/center_y_frac"] = center_y
-    predicted["pick_stats/ncc_score"] = threshold
-    predicted["pick_stats/power"] = threshold
-    all_predicted.append(predicted)
-
-# Save particle locations and stop job
-job.save_output("predicted_particles", Dataset.append(*all_predicted))
-job.stop()
+parser.add_argument("--filter_cache_dir", type=str, help="Filtered micrograph cache directory (default: cryolo_filter_cache in the project directory)")
+parser.add_argument("--resume_job", type=str, help="ID of an interrupted chunked crYOLO job to resume instead of creating a new job")
+
+
+def run(args, timings=None, gpu_slots=nullcontext):
+    """
+    Run crYOLO picking for parsed command line ``args`` and return the external job.
+
+    Resource use per stage is reported in the job directory and wall time per stage is also added to ``timings``.
+    Prediction runs inside ``gpu_slots(gpus)``, so that a batch driver can limit how many jobs share a GPU.
+    """
+    profile = Profile("crYOLO_particlepicker", timings)
+
+    # Connect to CryoSPARC instance (login credentials from .env file, reused within a process)
+    with profile.stage("setup"):
+        cs = connect(args.baseport)
+
+        # Find project and create job (or reuse the job of an interrupted run)
+        project = find_project(cs, args.project)
+        curate_job = find_job(project, args.curate_exposures_job_id)
+        if args.resume_job:
+            job = project.find_external_job(args.resume_job)
+            if job.status in ("running", "waiting"):
+                job.stop(error=f"Interrupted while {job.status}, resumed by a new run")
+        else:
+            job = project.create_external_job(args.workspace, title=args.title)
+
+            # Connect micrographs to the job and add output
+            job.connect(
+                "all_micrographs",
+                args.curate_exposures_job_id,
+                "exposures_accepted",
+                slots=["micrograph_blob"],
+            )
+            job.add_output("particle", "predicted_particles", slots=["location", "pick_stats"])
+
+            # A retry with the same arguments resumes this job instead of creating another one, once it is fully set up
+            # (a job left half set up by an error above is not resumed)
+            args.resume_job = job.uid
+    profile.instrument_job(job)
+
+    # Wait for all previous jobs to finish (fails if one of them fails)
+    job.start(status="waiting")
+    job.log(f"Waiting for job {args.curate_exposures_job_id} to finish.")
+    with profile.stage("wait"):
+        wait_for_jobs(job, [curate_job])
+    job.stop()
+
+    # Start the job and set its status to "running"
+    job.log(f"Starting job - {job.uid}")
+    job.start(status="running")
+
+    # Symlink the micrographs (links left by an interrupted run are kept)
+    with profile.stage("staging"):
+        all_micrographs = job.load_input("all_micrographs", ["micrograph_blob"])
+        stage_files(job, project, all_micrographs["micrograph_blob/path"], "full_data")
+
+    # Configure crYOLO
+    with profile.stage("config"):
+        job.subprocess(
+            f"cryolo_gui.py config config_cryolo.json {args.box_size} --filter LOWPASS --low_pass_cutoff {args.lowpass}".split(" "),
+            cwd=job.dir(),
+            mute=True,
+            checkpoint=True,
+        )
+
+    # Run particle picking job, sharded over the requested GPUs
+    gpus = [int(gpu) for gpu in args.gpus.split(",")]
+    predict_threshold = args.threshold if args.predict_threshold is None else min(args.predict_threshold, args.threshold)
+    names = list(micrograph_names(all_micrographs["micrograph_blob/path"]))
+
+    # Share filtered micrographs with other crYOLO jobs using the same micrographs and filter settings
+    filter_cache = None
+    if args.filter_cache_gb:
+        with open(job.dir() / "config_cryolo.json", "r") as config_file:
+            input_size = json.load(config_file)["model"]["input_size"]
+        filter_cache = FilterCache(
+            args.filter_cache_dir or f"{project.dir()}/cryolo_filter_cache",
+            str(job.dir()),
+            [f"{project.dir()}/{path}" for path in all_micrographs["micrograph_blob/path"]],
+            ("LOWPASS", args.lowpass, input_size),
+            args.filter_cache_gb * 1e9,
+        )
+
+    def predict_command(input_folder, output_folder, gpu):
+        return f"{args.cryolo_predict} -c config_cryolo.json -w {args.model_path} -i {input_folder} -g {gpu} -o {output_folder} -t {predict_threshold} -pbs {args.predict_batch}".split(" ")
+
+    # Keep all picks in the job's pick store so that other thresholds can be applied with crYOLO_repick.py, and output
+    # the picks above the threshold. Fill CrYOLO threshold as NCC and power score so that the results may be inspected
+    # and filtered with an Inspect Picks job.
+    with PickStoreWriter(pick_store_path(job), all_micrographs) as pick_store:
+        if args.chunk_size:
+            # Save the picks after the first chunk so that downstream jobs can start early, then whenever the picks have
+            # doubled since the last save and after the last chunk, so the output is uploaded at most about twice over
+            n_chunks = len(split_chunks(names, args.chunk_size))
+            saved = 0
+            with profile.stage("predict"), gpu_slots(gpus):
+                for i, locations in stream_predictions(job, names, args.chunk_size, predict_command, gpus, filter_cache=filter_cache):
+                    pick_store.append(locations)
+                    pick_store.commit()
+                    if i == n_chunks - 1 or pick_store.count >= 2 * max(saved, 1):
+                        picked = PickStore(pick_store_path(job)).to_particles(job, args.threshold)
+                        job.save_output("predicted_particles", picked)
+                        saved = pick_store.count
+                        job.log(f"Saved {len(picked)} particles after chunk {i + 1}/{n_chunks}")
+        else:
+            with profile.stage("predict"), gpu_slots(gpus):
+                star_paths = predict_on_gpus(job, names, gpus, predict_command, "full_data", "boxfiles", filter_cache=filter_cache)
+            with profile.stage("import"):
+                pick_store.append(read_picks(star_paths))
+                pick_store.commit()
+                picked = PickStore(pick_store_path(job)).to_particles(job, args.threshold)
+            with profile.stage("save"):
+                job.save_output("predicted_particles", picked)
+
+    # Report resource use per stage
+    profile.write(str(job.dir()), job)
+
+    # Stop job
+    job.stop()
+    return job
+
+
+if __name__ == "__main__":
+    run(parser.parse_args())
@@ -0,0 +1,53 @@
+import argparse
+
+from job_wait import wait_for_jobs
+from pick_store import PickStore, pick_store_path
+from session import connect, find_job, find_project
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description="Re-threshold the picks of a finished crYOLO job within CryoSPARC, without predicting again.")
+parser.add_argument("project", type=str, help="Name of project to run the job in")
+parser.add_argument("workspace", type=str, help="Name of workspace to run the job in")
+parser.add_argument("cryolo_job_id", type=str, help="ID of the crYOLO picking job")
+parser.add_argument("threshold", type=float, help="New threshold for particle picking")
+parser.add_argument("--title", type=str, help='Title for job (default: "crYOLO Picks (threshold <threshold>)")')
+parser.add_argument("--baseport", type=str, default=39000, help="Cryosparc baseport (default: 39000)")
+
+
+def run(args):
+    """Re-threshold the picks of a crYOLO job for parsed command line ``args``; returns the new external job."""
+    # Connect to CryoSPARC instance (login credentials from .env file, reused within a process)
+    cs = connect(args.baseport)
+
+    # Find project and create job
+    project = find_project(cs, args.project)
+    job = project.create_external_job(args.workspace, title=args.title or f"crYOLO Picks (threshold {args.threshold})")
+    cryolo_job = find_job(project, args.cryolo_job_id)
+
+    # Connect the original picks to the job and add output
+    job.connect("picks", args.cryolo_job_id, "predicted_particles", slots=["location", "pick_stats"])
+    job.add_output("particle", "predicted_particles", slots=["location", "pick_stats"])
+
+    # Wait for the crYOLO job to finish
+    job.start(status="waiting")
+    job.log(f"Waiting for job {args.cryolo_job_id} to finish.")
+    wait_for_jobs(job, [cryolo_job])
+    job.stop()
+
+    # Start the job and set its status to "running"
+    job.log(f"Starting job - {job.uid}")
+    job.start(status="running")
+
+    # Apply the new threshold to all picks kept by the crYOLO job
+    all_picks = PickStore(pick_store_path(cryolo_job))
+    predicted = all_picks.to_particles(job, args.threshold)
+    job.log(f"Kept {len(predicted)} of {len(all_picks)} picks with threshold {args.threshold}")
+
+    # Save particle locations and stop job
+    job.save_output("predicted_particles", predicted)
+    job.stop()
+    return job
+
+
+if __name__ == "__main__":
+    run(parser.parse_args())
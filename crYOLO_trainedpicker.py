@@ -1,12 +1,16 @@
 import argparse
-from io import StringIO
 
 import numpy as np
-from cryosparc import star
-from cryosparc.dataset import Dataset
-from cryosparc.tools import CryoSPARC
-from dotenv import dotenv_values
-from numpy.core import records
+
+from annotations import write_annotations
+from instrumentation import Profile
+from job_wait import wait_for_jobs
+from pick_import import micrograph_names
+from pick_store import PickStore, PickStoreWriter, pick_store_path
+from prediction import predict_on_gpus, read_picks
+from session import connect, find_job, find_project
+from staging import stage_files
+from training_data import bin_micrographs, particle_counts, representative_subset
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description="Run crYOLO particle picking on a set of micrographs within CryoSPARC.")
@@ -50,149 +54,163 @@ parser.add_argument(
     default="",
     help='Start training from pretrained weights (default: "")',
 )
-args = parser.parse_args()
-
-# Load login credentials from .env file
-env_vars = dotenv_values(".env")
-license = env_vars["CRYOSPARC_LICENSE_ID"]
-host = env_vars["CRYOSPARC_HOST"]
-email = env_vars["CRYOSPARC_EMAIL"]
-password = env_vars["CRYOSPARC_PASSWORD"]
-
-# Connect to CryoSPARC instance
-cs = CryoSPARC(license=license, host=host, base_port=args.baseport, email=email, password=password)
-
-# Find project and create job
-project = cs.find_project(args.project)
-job = project.create_external_job(args.workspace, title=args.title)
-curate_job = project.find_job(args.exposure_sets_job_id)
-training_particles_job = project.find_job(args.training_particles_job_id)
-
-# Connect micrographs to the job and add output
-job.connect("train_micrographs", args.exposure_sets_job_id, "split_0", slots=["micrograph_blob"])
-job.connect(
-    "train_particles",
-    args.training_particles_job_id,
-    "particles_selected",
-    slots=["location"],
-)
-job.connect("all_micrographs", args.exposure_sets_job_id, "split_0", slots=["micrograph_blob"])
-job.connect("all_micrographs", args.exposure_sets_job_id, "remainder", slots=["micrograph_blob"])
-job.add_output("particle", "predicted_particles", slots=["location", "pick_stats"])
-
-# Wait for all previous jobs to finish
-job.start(status="waiting")
-job.log(f"Waiting for job {args.exposure_sets_job_id} and {args.training_particles_job_id} to finish.")
-curate_job.wait_for_status(status="completed")
-training_particles_job.wait_for_status(status="completed")
-job.stop()
-
-# Start the job and set its status to "running"
-job.log(f"Starting job - {job.uid}")
-job.start(status="running")
-
-# Create directories and symlink the data
-job.mkdir("full_data")
-job.mkdir("train_image")
-job.mkdir("train_annot")
-all_micrographs = job.load_input("all_micrographs", ["micrograph_blob"])
-train_micrographs = job.load_input("train_micrographs", ["micrograph_blob"])
-for mic in all_micrographs.rows():
-    source = mic["micrograph_blob/path"]
-    target = job.uid + "/full_data/" + source.split("/")[-1]
-    project.symlink(source, target)
-for mic in train_micrographs.rows():
-    source = mic["micrograph_blob/path"]
-    target = job.uid + "/train_image/" + source.split("/")[-1]
-    project.symlink(source, target)
-
-# Load the training particle locations. Split them up my micrograph path.
-# Compute the pixel locations and save them to a star file in this format
-job.mkdir("train_annot/STAR")
-train_particles = job.load_input("train_particles", ["location"])
-
-for micrograph_path, particles in train_particles.split_by("location/micrograph_path").items():
-    micrograph_name = micrograph_path.split("/")[-1]
-    star_file_name = micrograph_name.rsplit(".", 1)[0] + ".star"
-
-    mic_w = particles["location/micrograph_shape"][:, 1]
-    mic_h = particles["location/micrograph_shape"][:, 0]
-    center_x = particles["location/center_x_frac"]
-    center_y = particles["location/center_y_frac"]
-    location_x = center_x * mic_w
-    location_y = center_y * mic_h
-
-    outfile = StringIO()
-    star.write(
-        outfile,
-        records.fromarrays([location_x, location_y], names=["rlnCoordinateX", "rlnCoordinateY"]),
-    )
-    outfile.seek(0)
-    job.upload("train_annot/STAR/" + star_file_name, outfile)
-
-# Configure crYOLO
-job.subprocess(
-    (
-        f"cryolo_gui.py config config_cryolo.json {args.box_size} "
-        "--train_image_folder train_image "
-        "--train_annot_folder train_annot "
-        f"--batch_size {args.batch_size} "
-        f"--pretrained_weights {args.pretrained_weights}"
-    ).split(" "),
-    cwd=job.dir(),
+parser.add_argument(
+    "--predict_threshold",
+    type=float,
+    help="Lower threshold to run crYOLO prediction with; all picks above it are kept in the picks store of the job for crYOLO_repick.py (default: same as --threshold)",
 )
-
-# Training
-# To run the training on GPU 0 with 5 warmup-epochs and an early stop
-# of 15 navigate to the folder with config_cryolo.json file, train_image folder etc.
-print("start training...")
-job.subprocess(
-    "cryolo_train.py -c config_cryolo.json -w 5 -g 0 -e 15".split(" "),  #
-    cwd=job.dir(),
-    mute=True,
-    checkpoint=True,
-    checkpoint_line_pattern=r"Epoch \d+/\d+",  # e.g., "Epoch 42/200"
+parser.add_argument("--gpus", type=str, default="0", help="Comma separated GPUs to shard prediction over, e.g. 0,1,2,3 (default: 0)")
+parser.add_argument("--cryolo_predict", type=str, default="cryolo_predict.py", help="crYOLO prediction command (default: cryolo_predict.py)")
+parser.add_argument(
+    "--max_train_micrographs",
+    type=int,
+    default=0,
+    help="Train on at most this many micrographs with particles, spread over the range of particle counts per micrograph (default: 0, all)",
 )
-print("done training...")
-
-# Run particle picking job
-job.mkdir("boxfiles")
-job.subprocess(
-    f"cryolo_predict.py -c config_cryolo.json -w cryolo_model.h5 -i full_data -g 0 -o boxfiles -t {args.threshold} -pbs {args.predict_batch}".split(" "),
-    cwd=job.dir(),
-    mute=True,
-    checkpoint=True,
+parser.add_argument(
+    "--train_bin",
+    type=int,
+    default=1,
+    help="Bin training micrographs and annotations by this factor before training; keep binned micrographs larger than the crYOLO input size of 1024 pixels (default: 1, no binning)",
 )
+parser.add_argument("--train_bin_workers", type=int, help="Processes for binning training micrographs (default: number of CPUs)")
+parser.add_argument("--train_cache_gb", type=float, default=50, help="Keep at most this many GB of binned training micrographs for later runs (default: 50)")
+parser.add_argument("--train_cache_dir", type=str, help="Binned training micrograph cache directory (default: cryolo_train_cache in the project directory)")
+
+
+def run(args):
+    """Train a crYOLO model and pick particles for parsed command line ``args``; returns the external job."""
+    profile = Profile("crYOLO_trainedpicker")
+
+    # Connect to CryoSPARC instance (login credentials from .env file, reused within a process)
+    profile.begin("setup")
+    cs = connect(args.baseport)
+
+    # Find project and create job
+    project = find_project(cs, args.project)
+    job = project.create_external_job(args.workspace, title=args.title)
+    curate_job = find_job(project, args.exposure_sets_job_id)
+    training_particles_job = find_job(project, args.training_particles_job_id)
+
+    # Connect micrographs to the job and add output
+    job.connect("train_micrographs", args.exposure_sets_job_id, "split_0", slots=["micrograph_blob"])
+    job.connect(
+        "train_particles",
+        args.training_particles_job_id,
+        "particles_selected",
+        slots=["location"],
+    )
+    job.connect("all_micrographs", args.exposure_sets_job_id, "split_0", slots=["micrograph_blob"])
+    job.connect("all_micrographs", args.exposure_sets_job_id, "remainder", slots=["micrograph_blob"])
+    job.add_output("particle", "predicted_particles", slots=["location", "pick_stats"])
+    profile.instrument_job(job)
+
+    # Wait for all previous jobs to finish (fails if one of them fails)
+    job.start(status="waiting")
+    job.log(f"Waiting for job {args.exposure_sets_job_id} and {args.training_particles_job_id} to finish.")
+    profile.begin("wait")
+    wait_for_jobs(job, [curate_job, training_particles_job])
+    job.stop()
+
+    # Start the job and set its status to "running"
+    job.log(f"Starting job - {job.uid}")
+    job.start(status="running")
+
+    # Load the inputs, and optionally keep only a subset of the training micrographs with a representative range of
+    # particle counts
+    profile.begin("staging")
+    all_micrographs = job.load_input("all_micrographs", ["micrograph_blob"])
+    train_micrographs = job.load_input("train_micrographs", ["micrograph_blob"])
+    train_particles = job.load_input("train_particles", ["location"])
+    train_paths = train_micrographs["micrograph_blob/path"]
+    if args.max_train_micrographs:
+        counts = particle_counts(train_paths, train_particles["location/micrograph_path"])
+        train_paths = train_paths[representative_subset(counts, args.max_train_micrographs)]
+        train_particles = train_particles.mask(np.isin(train_particles["location/micrograph_path"].astype(str), train_paths.astype(str)))
+        job.log(f"Training on {len(train_paths)} of {len(train_micrographs)} micrographs with {len(train_particles)} particles")
+
+    # Symlink the data; training micrographs are binned into a project-wide cache instead if requested
+    stage_files(job, project, all_micrographs["micrograph_blob/path"], "full_data")
+    if args.train_bin > 1:
+        profile.begin("binning")
+        bin_micrographs(
+            job,
+            [f"{project.dir()}/{path}" for path in train_paths],
+            "train_image",
+            args.train_bin,
+            args.train_cache_dir or f"{project.dir()}/cryolo_train_cache",
+            args.train_cache_gb * 1e9,
+            args.train_bin_workers,
+        )
+    else:
+        stage_files(job, project, train_paths, "train_image")
+
+    # Compute the pixel locations of the training particles (on the binned micrographs)
+    # and save them to one star file per micrograph
+    profile.begin("annotations")
+    write_annotations(job, train_particles, "train_annot/STAR", args.train_bin)
+
+    # Configure crYOLO. With binned training micrographs, training gets its own config with the box size scaled to the
+    # binned pixels, and prediction on the full micrographs uses the unscaled config. Both keep the --lowpass cutoff.
+    profile.begin("config")
+    train_config = "config_cryolo.json"
+    filter_options = ""
+    if args.train_bin > 1:
+        train_config = "config_cryolo_train.json"
+        filter_options = f"--filter LOWPASS --low_pass_cutoff {args.lowpass} "
+        job.subprocess(f"cryolo_gui.py config config_cryolo.json {args.box_size} --filter LOWPASS --low_pass_cutoff {args.lowpass}".split(" "), cwd=job.dir())
+    job.subprocess(
+        (
+            f"cryolo_gui.py config {train_config} {round(args.box_size / args.train_bin)} "
+            "--train_image_folder train_image "
+            "--train_annot_folder train_annot "
+            f"{filter_options}"
+            f"--batch_size {args.batch_size} "
+            f"--pretrained_weights {args.pretrained_weights}"
+        ).split(" "),
+        cwd=job.dir(),
+    )
 
-# Fill CrYOLO threshold as NCC and power score so that the results may be inspected and filtered with an Inspect Picks job.
-output_star_folder = "STAR"
-all_predicted = []
+    # Training
+    # To run the training on GPU 0 with 5 warmup-epochs and an early stop
+    # of 15 navigate to the folder with config_cryolo.json file, train_image folder etc.
+    print("start training...")
+    profile.begin("train")
+    job.subprocess(
+        f"cryolo_train.py -c {train_config} -w 5 -g 0 -e 15".split(" "),  #
+        cwd=job.dir(),
+        mute=True,
+        checkpoint=True,
+        checkpoint_line_pattern=r"Epoch \d+/\d+",  # e.g., "Epoch 42/200"
+    )
+    print("done training...")
 
-starfile_path = "boxfiles/CRYOSPARC/cryosparc.star"
-locations = star.read(job.dir() / starfile_path)[""]
+    # Run particle picking job, sharded over the requested GPUs
+    profile.begin("predict")
+    job.mkdir("boxfiles")
+    gpus = [int(gpu) for gpu in args.gpus.split(",")]
+    predict_threshold = args.threshold if args.predict_threshold is None else min(args.predict_threshold, args.threshold)
+    names = list(micrograph_names(all_micrographs["micrograph_blob/path"]))
 
-for mic in all_micrographs.rows():
-    micrograph_path = mic["micrograph_blob/path"]
-    micrograph_name = micrograph_path.split("/")[-1]
-    height, width = mic["micrograph_blob/shape"]
+    def predict_command(input_folder, output_folder, gpu):
+        return f"{args.cryolo_predict} -c config_cryolo.json -w cryolo_model.h5 -i {input_folder} -g {gpu} -o {output_folder} -t {predict_threshold} -pbs {args.predict_batch}".split(" ")
 
-    center_x = locations[locations["rlnMicrographName"] == micrograph_name]["rlnCoordinateX"] / width
-    center_y = locations[locations["rlnMicrographName"] == micrograph_name]["rlnCoordinateY"] / height
-    threshold = locations[locations["rlnMicrographName"] == micrograph_name]["rlnAutopickFigureOfMerit"]
+    star_paths = predict_on_gpus(job, names, gpus, predict_command, "full_data", "boxfiles")
 
-    predicted = job.alloc_output(
-        "predicted_particles",
-        len(locations[locations["rlnMicrographName"] == micrograph_name]),
-    )
-    predicted["location/micrograph_uid"] = mic["uid"]
-    predicted["location/micrograph_path"] = mic["micrograph_blob/path"]
-    predicted["location/micrograph_shape"] = mic["micrograph_blob/shape"]
-    predicted["location/center_x_frac"] = center_x
-    predicted["location/center_y_frac"] = center_y
-    predicted["pick_stats/ncc_score"] = threshold
-    predicted["pick_stats/power"] = threshold
-    all_predicted.append(predicted)
-
-# Save particle locations and stop job
-job.save_output("predicted_particles", Dataset.append(*all_predicted))
-job.stop()
+    # Keep all picks in the job's pick store so that other thresholds can be applied with crYOLO_repick.py.
+    # Fill CrYOLO threshold as NCC and power score so that the results may be inspected and filtered with an Inspect Picks job.
+    profile.begin("import")
+    with PickStoreWriter(pick_store_path(job), all_micrographs) as pick_store:
+        pick_store.append(read_picks(star_paths))
+    predicted = PickStore(pick_store_path(job)).to_particles(job, args.threshold)
+
+    # Save particle locations and stop job
+    profile.begin("save")
+    job.save_output("predicted_particles", predicted)
+    profile.write(str(job.dir()), job)
+    job.stop()
+    return job
+
+
+if __name__ == "__main__":
+    run(parser.parse_args())
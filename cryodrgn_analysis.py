@@ -0,0 +1,146 @@
+import os
+import pickle
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+
+import numpy as np
+
+PLOTS = {"z_pca": "z_pca.png", "pc1_traversal": "pc1/pca_traversal.png", "pc2_traversal": "pc2/pca_traversal.png"}
+# Principal components traversed and volumes per traversal, as in cryodrgn analyze
+PCS = 2
+TRAJECTORY_POINTS = 10
+
+
+def analysis_runs(epochs, ksamples):
+    """``(epoch, ksample, output folder)`` for every combination; the folder only names k if several are compared."""
+    return [(epoch, k, f"cryodrgn_analyze_{epoch}" + (f"_k{k}" if len(ksamples) > 1 else "")) for epoch in epochs for k in ksamples]
+
+
+def analysis_workers(numexpr_max_threads, n_runs):
+    """Number of concurrent ``cryodrgn analyze`` processes that fit the CPUs when each uses ``numexpr_max_threads``."""
+    return max(1, min(n_runs, (os.cpu_count() or 1) // max(int(numexpr_max_threads), 1)))
+
+
+def analyze_all(job, cryodrgn_output, runs, apix, workers):
+    """
+    Run ``cryodrgn analyze`` for every ``(epoch, ksample, output folder)`` in ``runs`` with ``workers`` processes at a time,
+    logging the plots of each run as soon as it finishes. Volumes are skipped (see ``generate_volumes``).
+    """
+    job_dir = str(job.dir())
+
+    def analyze(epoch, k, folder):
+        tic = time()
+        # With --skip-vol cryodrgn does not create the pc folders, but still saves the traversal plots into them
+        for plot in PLOTS.values():
+            os.makedirs(os.path.dirname(f"{job_dir}/{folder}/{plot}"), exist_ok=True)
+        job.subprocess(f"cryodrgn analyze {cryodrgn_output} {epoch} -o {job_dir}/{folder} --Apix {apix} --ksample {k} --skip-vol".split(" "), cwd=job_dir, mute=True)
+        return time() - tic
+
+    job.log(f"Running {len(runs)} cryodrgn analyses, {workers} at a time")
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {pool.submit(analyze, *run): run for run in runs}
+        for future in as_completed(futures):
+            epoch, k, folder = futures[future]
+            job.log(f"Analysis of epoch {epoch} (ksample {k}) finished in {future.result():.0f}s, results in {job_dir}/{folder}")
+            for name, plot in PLOTS.items():
+                if os.path.exists(f"{job_dir}/{folder}/{plot}"):
+                    job.log_plot(f"{job_dir}/{folder}/{plot}", f"{name} epoch {epoch} k{k}")
+
+
+def pc_trajectories(z, pcs=PCS, points=TRAJECTORY_POINTS):
+    """
+    Latent points along the first ``pcs`` principal components of ``z`` as ``cryodrgn analyze`` traverses them:
+    ``points`` evenly spaced from the 5th to the 95th percentile of the PC, the other PCs at the mean.
+    """
+    mean = z.mean(axis=0)
+    _, _, components = np.linalg.svd(z - mean, full_matrices=False)
+    # Sign convention of scikit-learn's PCA (largest loading positive), so that traversals run the same way as cryodrgn's
+    components *= np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])[:, None]
+    pc = (z - mean) @ components.T
+    return [mean + np.linspace(*np.percentile(pc[:, i], (5, 95)), points)[:, None] * components[i] for i in range(pcs)]
+
+
+def volume_inputs(cryodrgn_output, epoch, analysis_output):
+    """
+    Write ``pc<i>/z_values.txt`` with the PC traversals of epoch ``epoch`` into ``analysis_output`` and return
+    ``(folder, z file)`` of every volume set to generate: the traversals and the k-means centers of the analysis.
+    """
+    with open(f"{cryodrgn_output}/z.{epoch}.pkl", "rb") as f:
+        z = pickle.load(f)
+    inputs = []
+    for i, trajectory in enumerate(pc_trajectories(np.asarray(z, dtype=np.float64))):
+        os.makedirs(f"{analysis_output}/pc{i + 1}", exist_ok=True)
+        np.savetxt(f"{analysis_output}/pc{i + 1}/z_values.txt", trajectory)
+        inputs.append((f"pc{i + 1}", f"{analysis_output}/pc{i + 1}/z_values.txt"))
+    for entry in sorted(os.scandir(analysis_output), key=lambda entry: entry.name):
+        if entry.name.startswith("kmeans") and os.path.exists(f"{entry.path}/centers.txt"):
+            inputs.append((entry.name, f"{entry.path}/centers.txt"))
+    return inputs
+
+
+def config_file(cryodrgn_output):
+    """Model config of a cryodrgn training output (``config.yaml``, or ``config.pkl`` of older cryodrgn versions)."""
+    return next((path for path in (f"{cryodrgn_output}/config.yaml", f"{cryodrgn_output}/config.pkl") if os.path.exists(path)), f"{cryodrgn_output}/config.yaml")
+
+
+def generate_volumes(job, cryodrgn_output, epoch, analysis_output, apix):
+    """
+    Generate the PC traversal and k-means volumes of the analysis of ``epoch`` in ``analysis_output`` with one
+    ``cryodrgn eval_vol`` process per volume set, all at the same time. Returns the volume folders.
+    """
+    inputs = volume_inputs(cryodrgn_output, epoch, analysis_output)
+    job_dir = str(job.dir())
+
+    def eval_vol(folder, zfile):
+        job.subprocess(
+            f"cryodrgn eval_vol {cryodrgn_output}/weights.{epoch}.pkl -c {config_file(cryodrgn_output)} --zfile {zfile} -o {analysis_output}/{folder} --Apix {apix}".split(" "),
+            cwd=job_dir,
+            mute=True,
+        )
+
+    tic = time()
+    with ThreadPoolExecutor(len(inputs)) as pool:
+        for future in [pool.submit(eval_vol, *volume_input) for volume_input in inputs]:
+            future.result()
+    folders = [folder for folder, _ in inputs]
+    job.log(f"Generated volumes for {', '.join(folders)} in {time() - tic:.0f}s")
+    return folders
+
+
+def volume_files(folder):
+    """Names of the ``vol_*.mrc`` maps in ``folder`` (none if it does not exist), in traversal order."""
+    return sorted(name for name in os.listdir(folder) if name.startswith("vol_") and name.endswith(".mrc")) if os.path.isdir(folder) else []
+
+
+def package_series(folder, zip_path, block_size=1 << 24):
+    """
+    Copy the ``vol_*.mrc`` files of ``folder`` into an uncompressed zip at ``zip_path``, in ``block_size`` blocks so
+    that memory use does not grow with the map size. Returns the number of volumes.
+    """
+    volumes = volume_files(folder)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name in volumes:
+            with open(f"{folder}/{name}", "rb") as src, archive.open(name, "w", force_zip64=True) as dst:
+                shutil.copyfileobj(src, dst, block_size)
+    return len(volumes)
+
+
+def save_volume_series(job, output_name, folder, apix):
+    """
+    Save the traversal volumes in ``folder`` as the volume series output ``output_name`` of the job; returns False
+    (and saves nothing) if no volumes were generated into the folder.
+    """
+    if not volume_files(folder):
+        job.log(f"No volumes in {folder}, {output_name} is not saved")
+        return False
+    zip_name = f"{job.uid}_{output_name}.zip"
+    count = package_series(folder, f"{job.dir()}/{zip_name}")
+    series = job.alloc_output(output_name, 1)
+    for field, value in {"series/path": f"{job.uid}/{zip_name}", "series/idx": 0, "series/series_length": count, "series/psize_A": apix}.items():
+        if field in series:
+            series[field] = value
+    job.save_output(output_name, series)
+    job.log(f"Saved {count} volumes of {folder} as {output_name}")
+    return True
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import shutil
+from time import time
+
+import numpy as np
+
+from cs_metadata import open_cs
+
+HASH_BLOCK = 1 << 24
+
+
+def file_sha1(path):
+    """SHA-1 of the contents of ``path``, read in 16 MB blocks."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def rotation_matrices(pose):
+    """
+    Rotation matrices of CryoSPARC axis-angle poses, as ``cryodrgn parse_pose_csparc`` computes them (exponential
+    map of the axis-angle vectors, transposed).
+    """
+    pose = np.asarray(pose, dtype=np.float32)
+    theta = np.linalg.norm(pose, axis=-1)
+    axis = pose / np.where(theta > 0, theta, 1)[:, None]
+    x, y, z = axis[:, 0], axis[:, 1], axis[:, 2]
+    zero = np.zeros_like(x)
+    K = np.stack([zero, -z, y, z, zero, -x, -y, x, zero], axis=-1).reshape(-1, 3, 3)
+    R = np.eye(3, dtype=np.float32) + np.sin(theta)[:, None, None] * K + (1 - np.cos(theta))[:, None, None] * (K @ K)
+    return R.transpose(0, 2, 1).astype(np.float32)
+
+
+def parse_poses(particles, D):
+    """``(rot, trans)`` as written by ``cryodrgn parse_pose_csparc -D D``; translations as a fraction of the box."""
+    trans = np.asarray(particles["alignments3D/shift"], dtype=np.float32) / D
+    return rotation_matrices(particles["alignments3D/pose"]), trans
+
+
+def parse_ctf(particles):
+    """CTF parameter array (N x 9, float32) as written by ``cryodrgn parse_ctf_csparc``."""
+    ctf_params = np.zeros((len(particles), 9), dtype=np.float32)
+    ctf_params[:, 0] = particles["blob/shape"][0][0]
+    ctf_params[:, 1] = particles["blob/psize_A"]
+    ctf_params[:, 2] = particles["ctf/df1_A"]
+    ctf_params[:, 3] = particles["ctf/df2_A"]
+    ctf_params[:, 4] = particles["ctf/df_angle_rad"] * 180 / np.pi
+    ctf_params[:, 5] = particles["ctf/accel_kv"]
+    ctf_params[:, 6] = particles["ctf/cs_mm"]
+    ctf_params[:, 7] = particles["ctf/amp_contrast"]
+    ctf_params[:, 8] = particles["ctf/phase_shift_rad"] * 180 / np.pi
+    return ctf_params
+
+
+def select_random(n_total, n, seed=0):
+    """
+    Sorted random subset of ``n`` of ``n_total`` particle indices, the same subset ``cryodrgn_utils select_random``
+    writes for ``--seed seed`` (which seeds the legacy NumPy generator).
+    """
+    return np.sort(np.random.RandomState(seed).choice(n_total, n, replace=False))
+
+
+def save_pkl(data, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def preprocess(job, particles_path, D, n_total, subset, cache_dir, seed=0):
+    """
+    Write ``pose.pkl``, ``ctf.pkl`` and ``ind<subset>.pkl`` for cryodrgn into the job directory from the refinement
+    particles in ``particles_path`` (memory-mapped, and only read if a pickle is not cached yet).
+
+    The pickles are cached in ``cache_dir`` under the SHA-1 of the particles file (and the box size, subset size and
+    seed), so re-running with other training options copies them instead of parsing the particles again. Returns the
+    names of the written files.
+    """
+    tic = time()
+    source = file_sha1(particles_path)
+    particles = None
+    outputs = {
+        "pose.pkl": (f"{source}_pose_D{D}.pkl", lambda particles: parse_poses(particles, D)),
+        "ctf.pkl": (f"{source}_ctf.pkl", parse_ctf),
+        f"ind{subset}.pkl": (f"{source}_ind{subset}_of{n_total}_select_random_seed{seed}.pkl", lambda particles: select_random(n_total, subset, seed)),
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    hits = 0
+    for name, (entry, build) in outputs.items():
+        entry = os.path.join(cache_dir, entry)
+        if os.path.exists(entry):
+            hits += 1
+        else:
+            particles = open_cs(particles_path) if particles is None else particles
+            save_pkl(build(particles), entry)
+        shutil.copyfile(entry, os.path.join(str(job.dir()), name))
+
+    job.log(f"Prepared {', '.join(outputs)} ({hits} of {len(outputs)} from cache {cache_dir}) in {time() - tic:.1f}s")
+    return list(outputs)
@@ -0,0 +1,38 @@
+import os
+import re
+
+WEIGHTS_PATTERN = re.compile(r"weights\.(\d+)\.pkl$")
+
+
+def latest_checkpoint(output_dir):
+    """
+    Last epoch (0-based) of a cryodrgn training output with both ``weights.N.pkl`` and ``z.N.pkl`` written, or None.
+
+    An epoch whose latent file is missing was interrupted while saving and is not used.
+    """
+    if not os.path.isdir(output_dir):
+        return None
+    epochs = [int(match.group(1)) for match in map(WEIGHTS_PATTERN.match, os.listdir(output_dir)) if match]
+    complete = [epoch for epoch in epochs if os.path.exists(os.path.join(output_dir, f"z.{epoch}.pkl"))]
+    return max(complete, default=None)
+
+
+def preprocessed_files(subset):
+    return ["pose.pkl", "ctf.pkl", f"ind{subset}.pkl"]
+
+
+def has_preprocessed(job_dir, subset):
+    """True if the pose, ctf and subset pickles of an earlier run are in the job directory; a resumed job keeps them."""
+    return all(os.path.exists(os.path.join(job_dir, name)) for name in preprocessed_files(subset))
+
+
+def resume_training(output_dir, epochs):
+    """
+    ``(last_epoch, load, done)`` for (re)starting cryodrgn training into ``output_dir``: the last complete checkpoint
+    (or None), the ``--load`` option to continue from it (empty for a fresh start) and whether all ``epochs`` are
+    already trained.
+    """
+    last_epoch = latest_checkpoint(output_dir)
+    if last_epoch is None:
+        return None, "", False
+    return last_epoch, f" --load {os.path.basename(output_dir)}/weights.{last_epoch}.pkl", last_epoch + 1 >= epochs
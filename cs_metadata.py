@@ -0,0 +1,46 @@
+import numpy as np
+from cryosparc.dataset import Dataset
+
+NUMPY_MAGIC = b"\x93NUMPY"
+
+
+def open_cs(path):
+    """Memory-mapped records of a ``.cs`` file in NumPy format; other formats are loaded as a Dataset."""
+    try:
+        return np.load(path, mmap_mode="r", allow_pickle=False)
+    except ValueError:
+        return Dataset.load(path)
+
+
+def cs_header(path):
+    """``(count, dtype)`` of a NumPy format ``.cs`` file from its header alone, or None for other formats."""
+    with open(path, "rb") as f:
+        if f.read(len(NUMPY_MAGIC)) != NUMPY_MAGIC:
+            return None
+        f.seek(0)
+        version = np.lib.format.read_magic(f)
+        read_header = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}.get(version)
+        if read_header is None:
+            return None
+        shape, _, dtype = read_header(f)
+    return shape[0], dtype
+
+
+def cs_metadata(path):
+    """
+    Particle count, pixel size (A) and box size (pixels) of a particles ``.cs`` file.
+
+    NumPy format files are read from the header and the first record only, without loading any column; other
+    formats fall back to loading the Dataset.
+    """
+    header = cs_header(path)
+    if header and header[0]:
+        first = open_cs(path)[0]
+        return {"count": header[0], "psize_A": float(first["blob/psize_A"]), "box_size": int(first["blob/shape"][0]), "fields": list(header[1].names)}
+    particles = Dataset.load(path)
+    return {
+        "count": len(particles),
+        "psize_A": float(particles["blob/psize_A"][0]) if len(particles) else None,
+        "box_size": int(particles["blob/shape"][0][0]) if len(particles) else None,
+        "fields": particles.fields(),
+    }
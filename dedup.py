@@ -0,0 +1,85 @@
+from time import time
+
+import numpy as np
+
+from annotations import pixel_coordinates
+
+# Neighbouring grid cells (including the cell itself) searched for picks within the radius
+CELL_OFFSETS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def neighbour_pairs(groups, x, y, radius):
+    """
+    Index pairs ``(i, j)`` of points in the same group (e.g. micrograph) closer than ``radius``.
+
+    Points are hashed into a grid of ``radius`` sized cells per group and only the 3 x 3 cells around each point are
+    compared, so the work grows with the number of close pairs instead of quadratically per group.
+    """
+    cx = np.floor(x / radius).astype(np.int64)
+    cy = np.floor(y / radius).astype(np.int64)
+    cx -= cx.min(initial=0) - 1
+    cy -= cy.min(initial=0) - 1
+    width = int(max(cx.max(initial=0), cy.max(initial=0))) + 2
+    keys = (np.asarray(groups, dtype=np.int64) * width + cx) * width + cy
+    # Work in key order, so that the neighbour cell lookups are sorted queries
+    order = np.argsort(keys, kind="stable")
+    keys, x, y = keys[order], x[order], y[order]
+
+    first, second = [], []
+    for dx, dy in CELL_OFFSETS:
+        query = keys + dx * width + dy
+        start = np.searchsorted(keys, query, "left")
+        counts = np.searchsorted(keys, query, "right") - start
+        i = np.repeat(np.arange(len(keys)), counts)
+        j = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        close = (i < j) & ((x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2 < radius**2)
+        first.append(order[i[close]])
+        second.append(order[j[close]])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def suppress(scores, pairs):
+    """
+    Keep mask of greedy non-maximum suppression: going from the highest score down, a point is kept unless a kept
+    point is one of its ``pairs`` neighbours. Ties go to the lower index.
+
+    Resolved in rounds over all pairs at once: points without undecided better neighbours are kept, and their
+    neighbours dropped, until every point is decided (a few rounds for typical pick densities).
+    """
+    first, second = pairs
+    rank = np.empty(len(scores), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(scores)), -np.asarray(scores)))] = np.arange(len(scores))
+    swap = rank[first] > rank[second]
+    better, worse = np.where(swap, second, first), np.where(swap, first, second)
+
+    undecided = np.ones(len(scores), dtype=bool)
+    keep = np.zeros(len(scores), dtype=bool)
+    while undecided.any():
+        blocked = np.zeros(len(scores), dtype=bool)
+        blocked[worse[undecided[better]]] = True
+        kept = undecided & ~blocked
+        keep |= kept
+        undecided &= ~kept
+        undecided[worse[kept[better]]] = False
+        active = undecided[better] & undecided[worse]
+        better, worse = better[active], worse[active]
+    return keep
+
+
+def deduplicate(particles, radius):
+    """
+    Indices of the picks of ``particles`` to keep after removing duplicates: of picks on the same micrograph closer
+    than ``radius`` pixels, the one with the highest ``pick_stats/ncc_score`` (the crYOLO confidence) is kept.
+    """
+    _, groups = np.unique(particles["location/micrograph_uid"], return_inverse=True)
+    x, y = pixel_coordinates(particles)
+    pairs = neighbour_pairs(groups.reshape(-1), np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), radius)
+    return np.flatnonzero(suppress(particles["pick_stats/ncc_score"], pairs))
+
+
+def deduplicate_job(job, particles, radius):
+    """Picks of ``particles`` left after ``deduplicate``, logging the counts to ``job``."""
+    tic = time()
+    keep = deduplicate(particles, radius)
+    job.log(f"Kept {len(keep)} of {len(particles)} picks at least {radius:.1f} px apart in {time() - tic:.1f}s")
+    return particles.take(keep)
@@ -0,0 +1,61 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from relion_export import link_name
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(star_path):
+    """Manifest stored beside the exported STAR file."""
+    return f"{star_path}.manifest.json"
+
+
+def load_manifest(path):
+    """Manifest of the previous export, or an empty one if it is missing, unreadable or from another version."""
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION, "star": None, "stacks": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "star": None, "stacks": {}}
+    return manifest
+
+
+def save_manifest(path, manifest):
+    """Write the manifest atomically, so an interrupted export never leaves a half-written one."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def file_stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def stack_entries(project_dir, counts, relion_project_path, threads=16):
+    """
+    Manifest entries (size, mtime, particle count and whether the RELION link exists) of the referenced particle
+    stacks, keyed by their project-relative path. Files are stat'ed in a thread pool since each call is a round trip
+    on network file systems.
+    """
+
+    def entry(path):
+        stat = file_stat(os.path.join(project_dir, path)) or {"size": None, "mtime_ns": None}
+        return {**stat, "particles": counts[path], "linked": os.path.lexists(os.path.join(relion_project_path, link_name(path)))}
+
+    paths = sorted(counts)
+    with ThreadPoolExecutor(threads) as pool:
+        return dict(zip(paths, pool.map(entry, paths)))
+
+
+def changed_stacks(manifest, stacks):
+    """Existing stacks that are new, unlinked, or whose size, mtime or particle count changed since the last export."""
+    return [path for path, entry in stacks.items() if entry["size"] is not None and (not entry["linked"] or manifest["stacks"].get(path) != entry)]
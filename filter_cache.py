@@ -0,0 +1,73 @@
+import hashlib
+import os
+import shutil
+from time import time
+
+FILTERED_FOLDER = "filtered_tmp"
+
+
+class FilterCache:
+    """
+    Project-wide cache of crYOLO filtered micrographs, shared by all crYOLO jobs in the project.
+
+    Entries are named by a hash of (micrograph path, mtime, filter parameters), so a changed micrograph or filter
+    setting never reuses a stale image. crYOLO writes filtered images to ``filtered_tmp/<input folder>/<name>``
+    and skips images that already exist there, so linking cached entries into that folder before prediction
+    skips filtering for them. Least recently used entries are evicted once the cache grows above ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir, job_dir, source_paths, filter_params, max_bytes):
+        self.cache_dir = cache_dir
+        self.job_dir = job_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.entries = {}
+        params = ":".join(map(str, filter_params))
+        for path in source_paths:
+            name = os.path.basename(path)
+            key = hashlib.sha1(f"{os.path.realpath(path)}:{os.stat(path).st_mtime_ns}:{params}".encode()).hexdigest()
+            self.entries[name] = os.path.join(cache_dir, key + os.path.splitext(name)[1])
+
+    def link(self, input_folder, names):
+        """Link cached filtered images to where crYOLO looks for them when predicting ``input_folder``."""
+        folder = os.path.join(self.job_dir, FILTERED_FOLDER, input_folder)
+        os.makedirs(folder, exist_ok=True)
+        hits = 0
+        now = time()
+        for name in names:
+            entry, target = self.entries[name], os.path.join(folder, name)
+            if os.path.exists(entry) and not os.path.lexists(target):
+                os.symlink(entry, target)
+                os.utime(entry, (now, now))
+                hits += 1
+        return hits
+
+    def collect(self, input_folder, names):
+        """Move images crYOLO filtered for ``input_folder`` into the cache, leaving links behind."""
+        folder = os.path.join(self.job_dir, FILTERED_FOLDER, input_folder)
+        stored = 0
+        for name in names:
+            entry, filtered = self.entries[name], os.path.join(folder, name)
+            if os.path.isfile(filtered) and not os.path.islink(filtered):
+                # The cache directory may be on another file system than the job directory
+                shutil.move(filtered, entry)
+                os.symlink(entry, filtered)
+                stored += 1
+        return stored
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in ``max_bytes``; returns the bytes freed."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            os.remove(path)
+            freed += size
+        return freed
@@ -0,0 +1,185 @@
+import argparse
+import csv
+import json
+import os
+import resource
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from statistics import median
+from time import localtime, strftime, thread_time, time
+
+# Requests are counted by wrapping the request methods of the API client of cryosparc-tools 5.x, or urlopen of
+# cryosparc.command in 4.x
+try:
+    from cryosparc.api import APINamespace
+except ImportError:
+    APINamespace = None
+try:
+    import cryosparc.command as cryosparc_command
+except ImportError:
+    cryosparc_command = None
+
+REPORT_NAME = "instrumentation"
+METRICS = ["calls", "wall_s", "cpu_s", "peak_rss_mb", "read_mb", "write_mb", "api_calls"]
+
+_api_lock = threading.Lock()
+_api_calls = 0
+
+
+def _counting(request):
+    def counted(*args, **kwargs):
+        global _api_calls
+        with _api_lock:
+            _api_calls += 1
+        return request(*args, **kwargs)
+
+    counted.counting = True
+    return counted
+
+
+def count_api_calls():
+    """Count every HTTP request of cryosparc-tools (commands, dataset loads and saves, uploads) from now on."""
+    if APINamespace is not None:
+        for name in ("_request", "_request_stream"):
+            if not getattr(getattr(APINamespace, name), "counting", False):
+                setattr(APINamespace, name, _counting(getattr(APINamespace, name)))
+    elif cryosparc_command is not None and not getattr(cryosparc_command.urlopen, "counting", False):
+        cryosparc_command.urlopen = _counting(cryosparc_command.urlopen)
+
+
+def io_bytes():
+    """Bytes read from and written to storage by this process and its finished subprocesses (Linux only, else 0)."""
+    try:
+        with open("/proc/self/io") as f:
+            values = dict(line.split(": ") for line in f.read().splitlines())
+        return int(values["read_bytes"]), int(values["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def snapshot():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, write_bytes = io_bytes()
+    return {
+        "time": time(),
+        "cpu": thread_time() + children.ru_utime + children.ru_stime,
+        "rss": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, children.ru_maxrss),
+        "read": read_bytes,
+        "write": write_bytes,
+        "api": _api_calls,
+    }
+
+
+class Profile:
+    """
+    Resource use per stage of a script: wall time, CPU time (this thread plus finished subprocesses), peak RSS so far
+    (this process or its largest subprocess), bytes read/written and CryoSPARC API requests.
+
+    I/O and API counts are process-wide, so stages of runs sharing a process (e.g. from ``batch_pick.py``) include
+    each other's work. Wall times are also added to ``timings`` if given
+    (seconds per stage, as ``batch_pick.py`` reports them).
+    """
+
+    def __init__(self, script, timings=None):
+        self.script = script
+        self.started = time()
+        self.timings = timings
+        self.stages = {}
+        self.current = None
+        count_api_calls()
+
+    @contextmanager
+    def stage(self, name, timed=True):
+        """Record the ``with`` block as stage ``name``; ``timed=False`` keeps it out of ``timings``."""
+        start = snapshot()
+        try:
+            yield
+        finally:
+            self.record(name, start, snapshot(), timed)
+
+    def begin(self, name):
+        """End the current stage started with ``begin`` (if any) and start stage ``name``, for stages run in sequence."""
+        self.end()
+        self.current = (name, snapshot())
+
+    def end(self):
+        if self.current:
+            name, start = self.current
+            self.current = None
+            self.record(name, start, snapshot())
+
+    def record(self, name, start, end, timed=True):
+        stage = self.stages.setdefault(name, dict.fromkeys(METRICS, 0))
+        stage["calls"] += 1
+        stage["wall_s"] += end["time"] - start["time"]
+        stage["cpu_s"] += end["cpu"] - start["cpu"]
+        stage["peak_rss_mb"] = max(stage["peak_rss_mb"], end["rss"] / 1024)
+        stage["read_mb"] += (end["read"] - start["read"]) / 1e6
+        stage["write_mb"] += (end["write"] - start["write"]) / 1e6
+        stage["api_calls"] += end["api"] - start["api"]
+        if timed and self.timings is not None:
+            self.timings[name] = self.timings.get(name, 0.0) + end["time"] - start["time"]
+
+    def instrument_job(self, job):
+        """Record every ``job.subprocess`` call of ``job`` as a stage named after its command (overlapping the script's stages)."""
+        subprocess = job.subprocess
+
+        def profiled(args, *rest, **kwargs):
+            command = args.split(" ") if isinstance(args, str) else list(map(str, args))
+            name = "subprocess " + " ".join(os.path.basename(part) for part in command[:2] if "=" not in part)
+            with self.stage(name, timed=False):
+                return subprocess(args, *rest, **kwargs)
+
+        job.subprocess = profiled
+        return job
+
+    def report(self):
+        return {"script": self.script, "started": self.started, "time": time(), "stages": self.stages}
+
+    def write(self, folder, job=None, name=REPORT_NAME):
+        """
+        Write the report as ``<name>.<start time>.json`` and ``.csv`` into ``folder``, so that the reports of resumed
+        or repeated runs are kept side by side, and log a summary to ``job`` (or print it). A stage started with
+        ``begin`` is ended first. Returns the path of the JSON report.
+        """
+        self.end()
+        path = os.path.join(folder, f"{name}.{strftime('%Y%m%d-%H%M%S', localtime(self.started))}")
+        with open(f"{path}.json", "w") as f:
+            json.dump(self.report(), f, indent=1)
+        with open(f"{path}.csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage"] + METRICS)
+            writer.writerows([name] + [round(stage[metric], 3) for metric in METRICS] for name, stage in self.stages.items())
+
+        summary = format_table(["stage"] + METRICS, [[name] + [stage[metric] for metric in METRICS] for name, stage in self.stages.items()])
+        (job.log if job is not None else print)(f"Stage resource use ({path}.json):\n{summary}")
+        return f"{path}.json"
+
+
+def format_table(header, rows):
+    rows = [[f"{value:.1f}" if isinstance(value, float) else str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in [header] + rows)
+
+
+def aggregate(reports, metric="wall_s"):
+    """``(script, stage, runs, median, min, max)`` of ``metric`` per stage over the ``reports`` of several runs."""
+    values = defaultdict(list)
+    for report in reports:
+        for name, stage in report["stages"].items():
+            values[(report["script"], name)].append(stage[metric])
+    return [(script, name, len(v), median(v), min(v), max(v)) for (script, name), v in sorted(values.items())]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate the instrumentation.*.json reports of several runs per script and stage.")
+    parser.add_argument("reports", nargs="+", help="instrumentation.*.json files")
+    parser.add_argument("--metric", default="wall_s", choices=METRICS, help="Metric to aggregate (default: wall_s)")
+    args = parser.parse_args()
+
+    reports = []
+    for path in args.reports:
+        with open(path) as f:
+            reports.append(json.load(f))
+    print(format_table(["script", "stage", "runs", "median", "min", "max"], aggregate(reports, args.metric)))
@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
+
+FAILED_STATUSES = ("failed", "killed")
+
+
+def job_status(upstream_job):
+    upstream_job.refresh()
+    return upstream_job.status
+
+
+def wait_for_jobs(job, upstream_jobs, poll=2, max_poll=30, backoff=1.5):
+    """
+    Wait until all ``upstream_jobs`` are completed, refreshing them concurrently in one polling loop.
+
+    The poll interval grows from ``poll`` to ``max_poll`` seconds by ``backoff`` each round. If an upstream job
+    fails or is killed, ``job`` is stopped with an error and a RuntimeError is raised.
+    """
+    tic = time()
+    pending = list(upstream_jobs)
+    delay = poll
+    with ThreadPoolExecutor(max(len(pending), 1)) as pool:
+        while pending:
+            statuses = list(pool.map(job_status, pending))
+            for upstream_job, status in zip(pending, statuses):
+                if status in FAILED_STATUSES:
+                    msg = f"Job {upstream_job.uid} {status}, stopping."
+                    job.log(msg, level="error")
+                    job.stop(error=msg)
+                    raise RuntimeError(msg)
+                if status == "completed":
+                    job.log(f"Job {upstream_job.uid} completed after waiting {time() - tic:.0f}s")
+
+            pending = [upstream_job for upstream_job, status in zip(pending, statuses) if status != "completed"]
+            if pending:
+                sleep(delay)
+                delay = min(delay * backoff, max_poll)
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def micrograph_names(paths):
+    """Basenames of micrograph paths, as crYOLO writes them to rlnMicrographName."""
+    return np.array([path.split("/")[-1] for path in paths], dtype=object)
+
+
+def index_picks(mic_names, pick_names):
+    """
+    Match picks to micrographs by name in one pass.
+
+    Returns (pick_mic, order): ``order`` holds the indices of matched picks sorted by micrograph (keeping the
+    STAR order within a micrograph) and ``pick_mic`` the micrograph row of each of them. Picks on micrographs
+    that are not in ``mic_names`` are dropped.
+    """
+    unique_names, inverse = np.unique(np.asarray(pick_names).astype(str), return_inverse=True)
+    lookup = {name: i for i, name in enumerate(mic_names)}
+    unique_mic = np.array([lookup.get(name, -1) for name in unique_names], dtype=np.int64)
+    pick_mic = unique_mic[inverse.reshape(-1)]
+
+    order = np.flatnonzero(pick_mic >= 0)
+    order = order[np.argsort(pick_mic[order], kind="stable")]
+    return pick_mic[order], order
+
+
+def fill_picks(predicted, micrographs, locations, pick_mic, order):
+    """Fill an allocated particle dataset with picks, using the crYOLO confidence as NCC and power score."""
+    shapes = micrographs["micrograph_blob/shape"][pick_mic]
+    predicted["location/micrograph_uid"] = micrographs["uid"][pick_mic]
+    predicted["location/micrograph_path"] = micrographs["micrograph_blob/path"][pick_mic]
+    predicted["location/micrograph_shape"] = shapes
+    predicted["location/center_x_frac"] = locations["rlnCoordinateX"][order] / shapes[:, 1]
+    predicted["location/center_y_frac"] = locations["rlnCoordinateY"][order] / shapes[:, 0]
+    threshold = locations["rlnAutopickFigureOfMerit"][order]
+    predicted["pick_stats/ncc_score"] = threshold
+    predicted["pick_stats/power"] = threshold
+    return predicted
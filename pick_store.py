@@ -0,0 +1,122 @@
+import json
+import os
+
+import numpy as np
+from cryosparc.dataset import CSDAT_FORMAT, Dataset
+
+from pick_import import fill_picks, index_picks, micrograph_names
+
+# All picks of a crYOLO job above its prediction threshold, kept for threshold-only re-picks
+PICK_STORE_FOLDER = "picks"
+COLUMNS = {"x": np.float32, "y": np.float32, "score": np.float32, "mic": np.uint32}
+MICROGRAPH_FIELDS = ["uid", "micrograph_blob/path", "micrograph_blob/shape"]
+
+
+class PickStoreWriter:
+    """
+    Write crYOLO picks into a columnar store in ``folder``: one raw file per column (float32 coordinates and score,
+    uint32 micrograph index), sorted by micrograph, with CSR offsets per micrograph and the micrograph table.
+
+    Picks are appended in batches (e.g. one per predicted chunk); batches must not go back to earlier micrographs.
+    ``commit`` makes everything appended so far readable with ``PickStore``.
+    """
+
+    def __init__(self, folder, micrographs):
+        self.folder = folder
+        self.micrographs = micrographs
+        self.mic_names = micrograph_names(micrographs["micrograph_blob/path"])
+        self.counts = np.zeros(len(self.mic_names), dtype=np.uint64)
+        self.last_mic = 0
+        os.makedirs(folder, exist_ok=True)
+        Dataset([(field, micrographs[field]) for field in MICROGRAPH_FIELDS]).save(os.path.join(folder, "micrographs.cs"), format=CSDAT_FORMAT)
+        self.files = {name: open(os.path.join(folder, f"{name}.bin"), "wb") for name in COLUMNS}
+        self.commit()
+
+    def append(self, locations):
+        """Append crYOLO cryosparc.star records (None for no picks); picks on unknown micrographs are dropped."""
+        if locations is None or not len(locations):
+            return 0
+        pick_mic, order = index_picks(self.mic_names, locations["rlnMicrographName"])
+        if len(pick_mic) and pick_mic[0] < self.last_mic:
+            raise ValueError("Picks must be appended in micrograph order")
+        columns = {
+            "x": locations["rlnCoordinateX"][order],
+            "y": locations["rlnCoordinateY"][order],
+            "score": locations["rlnAutopickFigureOfMerit"][order],
+            "mic": pick_mic,
+        }
+        for name, dtype in COLUMNS.items():
+            self.files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        self.counts += np.bincount(pick_mic, minlength=len(self.counts)).astype(np.uint64)
+        self.last_mic = int(pick_mic[-1]) if len(pick_mic) else self.last_mic
+        return len(pick_mic)
+
+    @property
+    def count(self):
+        """Number of picks appended so far."""
+        return int(self.counts.sum())
+
+    def commit(self):
+        for f in self.files.values():
+            f.flush()
+        offsets = np.concatenate([[0], np.cumsum(self.counts)]).astype(np.uint64)
+        np.save(os.path.join(self.folder, "offsets.npy"), offsets)
+        with open(os.path.join(self.folder, "meta.json"), "w") as f:
+            json.dump({"count": int(offsets[-1]), "columns": {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()}}, f)
+
+    def close(self):
+        self.commit()
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PickStore:
+    """
+    Memory-mapped pick store written by ``PickStoreWriter``. Columns are ``x``, ``y``, ``score`` and ``mic``; the picks
+    of micrograph ``i`` are rows ``offsets[i]:offsets[i + 1]`` (see ``micrograph``).
+    """
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, "meta.json")) as f:
+            meta = json.load(f)
+        self.folder = folder
+        self.count = meta["count"]
+        self.columns = {
+            name: np.memmap(os.path.join(folder, f"{name}.bin"), dtype=np.dtype(dtype), mode="r", shape=(self.count,)) if self.count else np.zeros(0, dtype) for name, dtype in meta["columns"].items()
+        }
+        self.offsets = np.load(os.path.join(folder, "offsets.npy"), mmap_mode="r")
+        self.micrographs = Dataset.load(os.path.join(folder, "micrographs.cs"))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def micrograph(self, i):
+        """Columns of the picks of micrograph ``i`` (memory-mapped slices)."""
+        start, stop = int(self.offsets[i]), int(self.offsets[i + 1])
+        return {name: column[start:stop] for name, column in self.columns.items()}
+
+    def select(self, threshold=None):
+        """Rows with a score of at least ``threshold`` (all rows without threshold)."""
+        if threshold is None:
+            return np.arange(self.count)
+        return np.flatnonzero(self.columns["score"] >= threshold)
+
+    def to_particles(self, job, threshold=None, output_name="predicted_particles"):
+        """Particle output ``output_name`` with the picks scoring at least ``threshold``, crYOLO score as NCC and power."""
+        rows = self.select(threshold)
+        locations = {"rlnCoordinateX": self.columns["x"], "rlnCoordinateY": self.columns["y"], "rlnAutopickFigureOfMerit": self.columns["score"]}
+        predicted = job.alloc_output(output_name, len(rows))
+        return fill_picks(predicted, self.micrographs, locations, self.columns["mic"][rows].astype(np.int64), rows)
+
+
+def pick_store_path(job):
+    return os.path.join(str(job.dir()), PICK_STORE_FOLDER)
@@ -0,0 +1,152 @@
+import glob
+import heapq
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from cryosparc import star
+
+CHUNK_DONE_FILE = "chunk_done.json"
+
+
+def split_chunks(names, chunk_size):
+    """Split micrograph names into consecutive chunks of at most ``chunk_size``."""
+    return [names[i : i + chunk_size] for i in range(0, len(names), chunk_size)]
+
+
+def shard_by_size(sizes, n_shards):
+    """Assign items to ``n_shards`` shards with balanced total size (largest first onto the lightest shard)."""
+    shards = [[] for _ in range(n_shards)]
+    heap = [(0, i) for i in range(n_shards)]
+    for i in np.argsort(sizes, kind="stable")[::-1]:
+        total, shard = heapq.heappop(heap)
+        shards[shard].append(int(i))
+        heapq.heappush(heap, (total + sizes[i], shard))
+    return [sorted(shard) for shard in shards]
+
+
+def link_chunk(job_dir, source_folder, chunk_folder, names):
+    """
+    Link micrographs from ``source_folder`` into ``chunk_folder`` (both relative to the job directory), removing links
+    to other micrographs left by an earlier run (e.g. with another GPU split), so the folder holds exactly ``names``.
+    """
+    chunk_dir = os.path.join(job_dir, chunk_folder)
+    os.makedirs(chunk_dir, exist_ok=True)
+    wanted = set(names)
+    for entry in os.scandir(chunk_dir):
+        if entry.is_symlink() and entry.name not in wanted:
+            os.remove(entry.path)
+    source = os.path.relpath(os.path.join(job_dir, source_folder), chunk_dir)
+    for name in names:
+        target = os.path.join(chunk_dir, name)
+        if not os.path.lexists(target):
+            os.symlink(os.path.join(source, name), target)
+
+
+def clear_outputs(job_dir, output_folder):
+    """Remove the crYOLO picks of an earlier run from ``output_folder``, including the per-GPU shard outputs."""
+    for folder in glob.glob(os.path.join(job_dir, output_folder, "CRYOSPARC")) + glob.glob(os.path.join(job_dir, output_folder, "gpu_*")):
+        shutil.rmtree(folder)
+
+
+def read_picks(star_paths):
+    """Read and merge crYOLO cryosparc.star files into one record array, or None if there are no picks."""
+    blocks = [star.read(path)[""] for path in star_paths if os.path.exists(path)]
+    blocks = [block for block in blocks if len(block)]
+    return np.concatenate(blocks) if blocks else None
+
+
+def with_filter_cache(job, filter_cache, inputs, predict):
+    """Run ``predict()`` with cached filtered images linked for ``inputs`` (pairs of input folder and names)."""
+    if filter_cache is None:
+        predict()
+        return
+    hits = sum(filter_cache.link(input_folder, names) for input_folder, names in inputs)
+    job.log(f"Reusing {hits} of {sum(len(names) for _, names in inputs)} filtered micrographs from {filter_cache.cache_dir}")
+    predict()
+    stored = sum(filter_cache.collect(input_folder, names) for input_folder, names in inputs)
+    freed = filter_cache.evict()
+    job.log(f"Cached {stored} newly filtered micrographs, evicted {freed / 1e9:.1f} GB")
+
+
+def predict_on_gpus(job, names, gpus, predict_command, input_folder, output_folder, source_folder="full_data", filter_cache=None):
+    """
+    Predict micrographs ``names`` from ``source_folder`` into ``output_folder`` and return the written STAR files.
+
+    ``predict_command(input_folder, output_folder, gpu)`` returns the cryolo_predict.py arguments. With several
+    GPUs the micrographs are sharded by file size into ``shards/<input_folder>/gpu_N`` and one ``job.subprocess``
+    worker runs per GPU, writing to ``<output_folder>/gpu_N``. If a ``FilterCache`` is given, cached filtered
+    micrographs are reused and newly filtered ones are added to the cache.
+    """
+    job_dir = str(job.dir())
+    clear_outputs(job_dir, output_folder)
+    if len(gpus) == 1:
+        if input_folder != source_folder:
+            link_chunk(job_dir, source_folder, input_folder, names)
+        with_filter_cache(job, filter_cache, [(input_folder, names)], lambda: job.subprocess(predict_command(input_folder, output_folder, gpus[0]), cwd=job_dir, mute=True, checkpoint=True))
+        return [os.path.join(job_dir, output_folder, "CRYOSPARC", "cryosparc.star")]
+
+    sizes = [os.path.getsize(os.path.join(job_dir, source_folder, name)) for name in names]
+    runs = []
+    for gpu, shard in zip(gpus, shard_by_size(sizes, len(gpus))):
+        if shard:
+            shard_folder = f"shards/{input_folder}/gpu_{gpu}"
+            shard_names = [names[i] for i in shard]
+            link_chunk(job_dir, source_folder, shard_folder, shard_names)
+            runs.append((shard_folder, f"{output_folder}/gpu_{gpu}", gpu, shard_names))
+
+    def run_shards():
+        with ThreadPoolExecutor(len(runs)) as pool:
+            workers = [pool.submit(job.subprocess, predict_command(shard_folder, shard_output, gpu), cwd=job_dir, mute=True) for shard_folder, shard_output, gpu, _ in runs]
+            for worker in workers:
+                worker.result()
+
+    job.log_checkpoint()
+    job.log(f"Predicting {len(names)} micrographs on GPUs {', '.join(str(run[2]) for run in runs)}")
+    with_filter_cache(job, filter_cache, [(shard_folder, shard_names) for shard_folder, _, _, shard_names in runs], run_shards)
+    return [os.path.join(job_dir, shard_output, "CRYOSPARC", "cryosparc.star") for _, shard_output, _, _ in runs]
+
+
+def chunk_done(job_dir, output_folder, names):
+    """
+    The STAR files written by a previous run that finished predicting exactly these micrographs into
+    ``output_folder``, or None if there was no such run.
+    """
+    done_file = os.path.join(job_dir, output_folder, CHUNK_DONE_FILE)
+    if not os.path.exists(done_file):
+        return None
+    with open(done_file, "r") as f:
+        done = json.load(f)
+    if done["names"] != list(names):
+        return None
+    return [os.path.join(job_dir, path) for path in done["star_files"]]
+
+
+def mark_chunk_done(job_dir, output_folder, names, star_paths):
+    """Record that ``names`` were predicted into ``output_folder`` and which shard STAR files hold their picks."""
+    os.makedirs(os.path.join(job_dir, output_folder), exist_ok=True)
+    with open(os.path.join(job_dir, output_folder, CHUNK_DONE_FILE), "w") as f:
+        json.dump({"names": list(names), "star_files": [os.path.relpath(path, job_dir) for path in star_paths]}, f)
+
+
+def stream_predictions(job, names, chunk_size, predict_command, gpus=(0,), source_folder="full_data", chunks_folder="chunks", output_folder="boxfiles", filter_cache=None):
+    """
+    Run crYOLO prediction chunk by chunk and yield ``(chunk_index, picks)`` as soon as each chunk finishes.
+
+    ``picks`` are the merged cryosparc.star records of the chunk (None if nothing was picked). Chunks finished by
+    an earlier run of the same job are not predicted again, so a crashed run resumes from the last completed chunk.
+    """
+    job_dir = str(job.dir())
+    chunks = split_chunks(names, chunk_size)
+    for i, chunk in enumerate(chunks):
+        chunk_output = f"{output_folder}/chunk_{i:03d}"
+        star_paths = chunk_done(job_dir, chunk_output, chunk)
+        if star_paths is not None:
+            job.log(f"Chunk {i + 1}/{len(chunks)} already predicted, skipping.")
+        else:
+            job.log(f"Predicting chunk {i + 1}/{len(chunks)} ({len(chunk)} micrographs)")
+            star_paths = predict_on_gpus(job, chunk, gpus, predict_command, f"{chunks_folder}/chunk_{i:03d}", chunk_output, source_folder, filter_cache)
+            mark_chunk_done(job_dir, chunk_output, chunk, star_paths)
+        yield i, read_picks(star_paths)
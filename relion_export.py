@@ -0,0 +1,247 @@
+import hashlib
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+import numpy as np
+
+from cs_metadata import open_cs
+from star_writer import WRITE_CHUNK, column_chunks, open_star, write_block
+
+
+class CsTable:
+    """
+    Read-only particles table of a CryoSPARC ``.cs`` file, joined by UID with its passthrough ``.cs`` file.
+
+    NumPy format files are memory-mapped, so only the columns and row slices that are accessed are read from disk.
+    Supports ``len``, ``field in table``, ``table[field]`` and ``table.slice(start, stop)`` like a Dataset.
+    """
+
+    def __init__(self, path, passthrough_path=None):
+        self.sources = [(open_cs(path), None)]
+        self.index = None
+        if passthrough_path and os.path.exists(passthrough_path):
+            passthrough = open_cs(passthrough_path)
+            uids, passthrough_uids = np.asarray(self.sources[0][0]["uid"]), np.asarray(passthrough["uid"])
+            rows, found = np.zeros(len(uids), dtype=np.int64), np.zeros(len(uids), dtype=bool)
+            if len(passthrough_uids):
+                order = np.argsort(passthrough_uids)
+                rows = order[np.searchsorted(passthrough_uids, uids, sorter=order).clip(max=len(order) - 1)]
+                found = passthrough_uids[rows] == uids
+            if not found.all():
+                self.index = np.flatnonzero(found)
+                rows = rows[found]
+            self.sources.append((passthrough, rows))
+        self.fields = {}
+        for source, rows in self.sources:
+            names = source.dtype.names if isinstance(source, np.ndarray) else source.fields()
+            for name in names:
+                self.fields.setdefault(name, (source, rows))
+
+    def __len__(self):
+        return len(self.sources[0][0]) if self.index is None else len(self.index)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def column(self, field, start=0, stop=None):
+        source, rows = self.fields[field]
+        stop = len(self) if stop is None else min(stop, len(self))
+        if rows is not None:
+            return np.asarray(source[field][rows[start:stop]])
+        if self.index is not None:
+            return np.asarray(source[field][self.index[start:stop]])
+        return np.asarray(source[field][start:stop])
+
+    def __getitem__(self, field):
+        return self.column(field)
+
+    def slice(self, start=0, stop=None):
+        """Dict of all columns for rows ``start`` to ``stop``."""
+        return {field: self.column(field, start, stop) for field in self.fields}
+
+
+def load_particles(particles_path, passthrough_path=None):
+    """Particles of a CryoSPARC job joined with their passthrough fields (location, ctf, ...) by UID."""
+    return CsTable(particles_path, passthrough_path)
+
+
+def link_name(path):
+    """Name of a particle stack in the RELION project; RELION expects ``.mrcs`` stacks."""
+    return path + "s" if path.endswith(".mrc") else path
+
+
+def link_stack(project_dir, relion_project_path, path):
+    """
+    Link one stack into the RELION project under its ``.mrcs`` name, replacing an outdated link. Anything else already
+    at the target (e.g. a real stack) is left alone and raises FileExistsError.
+    """
+    target = os.path.join(relion_project_path, link_name(path))
+    try:
+        os.symlink(os.path.join(project_dir, path), target)
+    except FileExistsError:
+        if not os.path.islink(target):
+            raise
+        os.remove(target)
+        os.symlink(os.path.join(project_dir, path), target)
+
+
+def link_stacks(project_dir, relion_project_path, paths, threads=32):
+    """
+    Link the particle stacks ``paths`` (relative to the project directory) into the RELION project directly under
+    their ``.mrcs`` names, creating the links from a thread pool so that file system latency (e.g. NFS) overlaps.
+    Returns the paths that could not be linked, with their errors.
+    """
+    for folder in sorted({os.path.dirname(path) for path in paths}):
+        os.makedirs(os.path.join(relion_project_path, folder), exist_ok=True)
+
+    def link(path):
+        try:
+            link_stack(project_dir, relion_project_path, path)
+        except OSError as e:
+            return path, e
+
+    with ThreadPoolExecutor(threads) as pool:
+        return [failure for failure in pool.map(link, paths) if failure]
+
+
+def stack_paths(particles):
+    """Project-relative particle stack paths of every particle, renamed to ``.mrcs`` as RELION expects."""
+    paths = np.asarray(particles["blob/path"]).astype(str)
+    return np.where(np.char.endswith(paths, ".mrc"), np.char.add(paths, "s"), paths)
+
+
+def optics_groups(particles):
+    """Optics group number (from 1) of every particle and the RELION optics block, one group per exposure group."""
+    exp_groups = particles["ctf/exp_group_id"] if "ctf/exp_group_id" in particles else np.zeros(len(particles), dtype=int)
+    unique_groups, first, group = np.unique(exp_groups, return_index=True, return_inverse=True)
+    optics = {
+        "rlnOpticsGroupName": np.array([f"opticsGroup{i + 1}" for i in range(len(unique_groups))]),
+        "rlnOpticsGroup": np.arange(1, len(unique_groups) + 1),
+        "rlnVoltage": particles["ctf/accel_kv"][first],
+        "rlnSphericalAberration": particles["ctf/cs_mm"][first],
+        "rlnAmplitudeContrast": particles["ctf/amp_contrast"][first],
+        "rlnImagePixelSize": particles["blob/psize_A"][first],
+        "rlnImageSize": particles["blob/shape"][first, 0],
+        "rlnImageDimensionality": np.full(len(unique_groups), 2),
+    }
+    return group.reshape(-1) + 1, optics
+
+
+def particle_columns(particles, stacks, group):
+    """RELION particle columns computed with vectorized NumPy from the CryoSPARC fields."""
+    columns = {"rlnImageName": np.char.add(np.char.add(np.char.zfill((particles["blob/idx"] + 1).astype(str), 6), "@"), stacks)}
+    if "location/micrograph_path" in particles:
+        shapes = particles["location/micrograph_shape"]
+        columns["rlnMicrographName"] = np.asarray(particles["location/micrograph_path"]).astype(str)
+        columns["rlnCoordinateX"] = particles["location/center_x_frac"] * shapes[:, 1]
+        columns["rlnCoordinateY"] = particles["location/center_y_frac"] * shapes[:, 0]
+    columns["rlnDefocusU"] = particles["ctf/df1_A"]
+    columns["rlnDefocusV"] = particles["ctf/df2_A"]
+    columns["rlnDefocusAngle"] = np.rad2deg(particles["ctf/df_angle_rad"])
+    columns["rlnPhaseShift"] = np.rad2deg(particles["ctf/phase_shift_rad"])
+    if "alignments2D/pose" in particles:
+        # In-plane rotation and shift (pixels) of the 2D classification, as pyem's csparc2star writes them
+        shifts = particles["alignments2D/shift"] * particles["blob/psize_A"][:, None]
+        columns["rlnAnglePsi"] = np.rad2deg(particles["alignments2D/pose"])
+        columns["rlnOriginXAngst"] = shifts[:, 0]
+        columns["rlnOriginYAngst"] = shifts[:, 1]
+    if "alignments2D/class" in particles:
+        columns["rlnClassNumber"] = particles["alignments2D/class"] + 1
+    columns["rlnOpticsGroup"] = group
+    return columns
+
+
+def chunk_digest(chunk):
+    """SHA-1 of all fields of a chunk of particles (independent of the string field widths), to detect changed rows between exports."""
+    digest = hashlib.sha1()
+    for field in sorted(chunk):
+        column = np.asarray(chunk[field])
+        digest.update(field.encode())
+        digest.update("\0".join(column.astype(str)).encode() if column.dtype.kind in "OSU" else np.ascontiguousarray(column).tobytes())
+    return digest.hexdigest()
+
+
+def stack_counts(state):
+    """Number of particles per referenced stack (``blob/path``) of an export state."""
+    counts = Counter()
+    for chunk in state["chunks"]:
+        counts.update(chunk["stacks"])
+    return dict(counts)
+
+
+def particle_chunks(particles, group, states, start_chunk=0, chunk_size=WRITE_CHUNK):
+    """
+    Yield the RELION particle columns ``chunk_size`` rows at a time from chunk ``start_chunk`` on, appending the digest
+    and per-stack particle counts of each chunk to ``states``.
+    """
+    for start in range(start_chunk * chunk_size, max(len(particles), 1), chunk_size):
+        chunk = particles.slice(start, start + chunk_size)
+        paths, counts = np.unique(np.asarray(chunk["blob/path"]).astype(str), return_counts=True)
+        states.append({"sha1": chunk_digest(chunk), "stacks": dict(zip(paths.tolist(), counts.tolist()))})
+        yield particle_columns(chunk, stack_paths(chunk), group[start : start + chunk_size])
+
+
+def unchanged_chunks(particles, previous, chunk_size):
+    """Number of leading chunks of ``particles`` identical to the ones of the previous export state."""
+    count = 0
+    for old, start in zip(previous["chunks"], range(0, len(particles), chunk_size)):
+        if chunk_digest(particles.slice(start, start + chunk_size)) != old["sha1"]:
+            break
+        count += 1
+    return count
+
+
+def export_star(particles, star_path, chunk_size=WRITE_CHUNK, compression=None, previous=None):
+    """
+    Write ``particles`` (a CsTable or Dataset) as a RELION 3.1 STAR file (optics and particles blocks) and return the
+    export state: row count, digests, file offsets and per-stack particle counts (see ``stack_counts``) of each chunk.
+
+    Particles are converted and written ``chunk_size`` rows at a time, so memory stays bounded for large exports. Given
+    the ``previous`` state of the same uncompressed file, rows are only rewritten from the first chunk that changed
+    (e.g. particles added by a live session); the file is left untouched if nothing changed.
+    """
+    group, optics = optics_groups(particles)
+    optics_text = StringIO()
+    write_block(optics_text, "optics", column_chunks(optics), version=30001)
+    optics_sha1 = hashlib.sha1(optics_text.getvalue().encode()).hexdigest()
+
+    n_chunks = len(range(0, max(len(particles), 1), chunk_size))
+    kept = 0
+    if (
+        previous
+        and compression is None
+        and previous["chunk_size"] == chunk_size
+        and previous["optics_sha1"] == optics_sha1
+        and os.path.exists(star_path)
+        and os.path.getsize(star_path) == previous["size"]
+    ):
+        kept = unchanged_chunks(particles, previous, chunk_size)
+        if kept == n_chunks == len(previous["chunks"]):
+            return {**previous, "rewritten_from": previous["rows"]}
+
+    states = [dict(chunk) for chunk in previous["chunks"][:kept]] if kept else []
+    offsets = [chunk["offset"] for chunk in states]
+    if kept:
+        with open(star_path, "r+") as f:
+            f.seek(previous["chunks"][kept]["offset"] if kept < len(previous["chunks"]) else previous["end"])
+            f.truncate()
+            write_block(f, "particles", particle_chunks(particles, group, states, kept, chunk_size), header=False, offsets=offsets)
+    else:
+        with open_star(star_path, compression) as f:
+            f.write(optics_text.getvalue())
+            write_block(f, "particles", particle_chunks(particles, group, states, 0, chunk_size), version=30001, offsets=offsets if compression is None else None)
+
+    if compression is None:
+        for chunk, offset in zip(states, offsets):
+            chunk["offset"] = offset
+    return {
+        "rows": len(particles),
+        "chunk_size": chunk_size,
+        "optics_sha1": optics_sha1,
+        "chunks": states,
+        "end": offsets[-1] if compression is None else None,
+        "size": os.path.getsize(star_path),
+        "rewritten_from": kept * chunk_size,
+    }
@@ -0,0 +1,63 @@
+import threading
+from functools import lru_cache
+from time import time
+
+from cryosparc.tools import CryoSPARC
+from dotenv import dotenv_values
+
+# Authenticated clients and project/job lookups, shared by every script run in this process (e.g. from a batch
+# driver) so that only the first run pays for reading .env, logging in and resolving projects and jobs.
+_lock = threading.Lock()
+_clients = {}
+_lookups = {}
+
+
+@lru_cache()
+def credentials(env_file=".env"):
+    """Login credentials from the .env file, read once per process."""
+    return dotenv_values(env_file)
+
+
+def connect(baseport=39000, env_file=".env"):
+    """CryoSPARC client for the instance in ``env_file`` at ``baseport``, created once per process."""
+    env_vars = credentials(env_file)
+    key = (env_vars["CRYOSPARC_HOST"], int(baseport), env_vars["CRYOSPARC_EMAIL"])
+    with _lock:
+        if key not in _clients:
+            _clients[key] = CryoSPARC(
+                license=env_vars["CRYOSPARC_LICENSE_ID"],
+                host=env_vars["CRYOSPARC_HOST"],
+                base_port=int(baseport),
+                email=env_vars["CRYOSPARC_EMAIL"],
+                password=env_vars["CRYOSPARC_PASSWORD"],
+            )
+        return _clients[key]
+
+
+def cached(key, lookup, ttl):
+    """Result of ``lookup()`` cached under ``key`` for ``ttl`` seconds."""
+    with _lock:
+        entry = _lookups.get(key)
+        if entry and time() - entry[0] < ttl:
+            return entry[1]
+    value = lookup()
+    with _lock:
+        _lookups[key] = (time(), value)
+    return value
+
+
+def find_project(cs, project_uid, ttl=300):
+    return cached((id(cs), project_uid), lambda: cs.find_project(project_uid), ttl)
+
+
+def find_job(project, job_uid, ttl=300):
+    """Job accessor for ``job_uid``; its status is refreshed by ``wait_for_jobs``, not by this cache."""
+    return cached((id(project.cs), project.uid, job_uid), lambda: project.find_job(job_uid), ttl)
+
+
+def invalidate(project_uid=None):
+    """Drop cached lookups, for one project or all of them."""
+    with _lock:
+        for key in list(_lookups):
+            if project_uid is None or key[1] == project_uid:
+                del _lookups[key]
@@ -0,0 +1,40 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+
+def stage_files(job, project, source_paths, folder, threads=16):
+    """
+    Link project files (paths relative to the project directory) into ``folder`` of the job, by basename.
+
+    Links that already exist are skipped. When the project directory is mounted locally, the missing links are
+    created directly with ``os.symlink``; otherwise they are created with ``project.symlink`` from a thread pool.
+    Returns the number of links created.
+    """
+    tic = time()
+    project_dir = str(project.dir())
+    job_dir = os.path.join(project_dir, job.uid)
+    local = os.path.isdir(job_dir)
+
+    targets = {}
+    for source in source_paths:
+        targets.setdefault(source.split("/")[-1], source)
+
+    if local:
+        os.makedirs(os.path.join(job_dir, folder), exist_ok=True)
+        existing = set(os.listdir(os.path.join(job_dir, folder)))
+    else:
+        job.mkdir(folder, parents=True, exist_ok=True)
+        existing = {path.split("/")[-1] for path in job.list_files(folder)}
+    missing = [(source, name) for name, source in targets.items() if name not in existing]
+
+    if local:
+        folder_dir = os.path.join(job_dir, folder)
+        for source, name in missing:
+            os.symlink(os.path.relpath(os.path.join(project_dir, source), folder_dir), os.path.join(folder_dir, name))
+    elif missing:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(lambda link: project.symlink(link[0], f"{job.uid}/{folder}/{link[1]}"), missing))
+
+    job.log(f"Linked {len(missing)} files into {folder} ({len(targets) - len(missing)} already present, {'local' if local else 'API'}) in {time() - tic:.1f}s")
+    return len(missing)
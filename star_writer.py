@@ -0,0 +1,67 @@
+import gzip
+
+import numpy as np
+
+WRITE_CHUNK = 100_000
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+
+
+def open_star(path, compression=None):
+    """
+    Text file handle for writing a STAR file at ``path``, optionally compressed with ``gzip`` or ``zstd``.
+
+    Without ``compression`` it is inferred from a ``.gz``/``.zst`` suffix. zstd needs the ``zstandard`` package.
+    """
+    if compression is None:
+        compression = next((name for suffix, name in COMPRESSIONS.items() if str(path).endswith(suffix)), None)
+    if compression is None:
+        return open(path, "w", buffering=1 << 22)
+    if compression == "gzip":
+        return gzip.open(path, "wt", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compressed STAR files need the zstandard package (pip install zstandard)")
+        return zstandard.open(path, "wt")
+    raise ValueError(f"Unknown STAR compression {compression!r}, use gzip or zstd")
+
+
+def format_rows(columns):
+    """STAR text rows for a dict of equally long column arrays."""
+    formatted = [np.asarray(column).astype(str) for column in columns.values()]
+    return "".join(" ".join(row) + "\n" for row in zip(*formatted))
+
+
+def write_block(f, name, chunks, version=None, header=True, offsets=None):
+    """
+    Write a STAR loop block ``data_<name>`` from ``chunks``, an iterable of dicts of column arrays with the same labels
+    (e.g. a generator over slices of a memory-mapped dataset). Only one chunk is held in memory at a time; the
+    labels are taken from the first chunk. Returns the number of rows written.
+
+    With ``header=False`` only the rows are written, to continue a block at the current position of ``f``. File
+    positions before each chunk and before the closing blank line are appended to ``offsets`` if given.
+    """
+    if header:
+        if version:
+            f.write(f"\n# version {version}\n")
+        f.write(f"\ndata_{name}\n\nloop_\n")
+    count = 0
+    for i, columns in enumerate(chunks):
+        if header and i == 0:
+            f.writelines(f"_{label} #{j + 1}\n" for j, label in enumerate(columns))
+        if offsets is not None:
+            offsets.append(f.tell())
+        f.write(format_rows(columns))
+        count += len(next(iter(columns.values())))
+    if offsets is not None:
+        offsets.append(f.tell())
+    f.write("\n")
+    return count
+
+
+def column_chunks(columns, chunk_size=WRITE_CHUNK):
+    """Yield ``chunk_size`` row slices of a dict of whole column arrays, to stream an in-memory table."""
+    total = len(next(iter(columns.values())))
+    for start in range(0, max(total, 1), chunk_size):
+        yield {label: column[start : start + chunk_size] for label, column in columns.items()}
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts and their helper modules live in the repository root, the fakes and generators in benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
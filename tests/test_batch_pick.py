@@ -0,0 +1,20 @@
+import pytest
+
+from batch_pick import transient
+
+
+@pytest.mark.parametrize("error", [ConnectionResetError(), TimeoutError()])
+def test_network_errors_are_transient(error):
+    assert transient(error)
+
+
+def test_httpx_transport_errors_are_transient():
+    httpx = pytest.importorskip("httpx")
+    assert transient(httpx.ConnectError("connection refused"))
+    assert transient(httpx.ReadTimeout("timed out"))
+    assert not transient(httpx.InvalidURL("bad url"))
+
+
+def test_other_errors_are_not_transient():
+    assert not transient(ValueError("bad manifest row"))
+    assert not transient(FileNotFoundError("model.h5"))
@@ -0,0 +1,89 @@
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+from fake_cryosparc import FakeCryoSPARC
+
+from cryodrgn_analysis import (
+    TRAJECTORY_POINTS,
+    analysis_runs,
+    analyze_all,
+    generate_volumes,
+    pc_trajectories,
+    save_volume_series,
+)
+
+# Stand-in for the cryodrgn command. Like cryodrgn 4.3.1, analyze --skip-vol writes neither the pc folders nor their
+# z values, but saves the traversal plots into the pc folders, and the k-means centers; eval_vol writes one map per
+# line of the --zfile.
+FAKE_CRYODRGN = """#!{python}
+import argparse, os, sys
+parser = argparse.ArgumentParser()
+parser.add_argument("command")
+parser.add_argument("input")
+parser.add_argument("epoch", nargs="?")
+parser.add_argument("-o")
+parser.add_argument("--zfile")
+parser.add_argument("--ksample", type=int, default=20)
+parser.add_argument("--skip-vol", action="store_true")
+args, _ = parser.parse_known_args()
+if args.command == "analyze":
+    assert args.skip_vol
+    os.makedirs(f"{{args.o}}/kmeans{{args.ksample}}")
+    open(f"{{args.o}}/kmeans{{args.ksample}}/centers.txt", "w").write("0 0\\n" * args.ksample)
+    for pc in ("pc1", "pc2"):
+        open(f"{{args.o}}/{{pc}}/pca_traversal.png", "wb").write(b"png")
+    open(f"{{args.o}}/z_pca.png", "wb").write(b"png")
+else:
+    os.makedirs(args.o, exist_ok=True)
+    for i in range(len(open(args.zfile).read().splitlines())):
+        open(f"{{args.o}}/vol_{{i:03d}}.mrc", "wb").write(b"map")
+"""
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "cryodrgn").write_text(FAKE_CRYODRGN.format(python=sys.executable))
+    (bin_dir / "cryodrgn").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return FakeCryoSPARC(str(tmp_path)).create_project("P1").create_external_job("W1")
+
+
+def test_analyze_and_generate_volumes(job):
+    cryodrgn_output = job.local_dir / "cryodrgn"
+    cryodrgn_output.mkdir()
+    with open(cryodrgn_output / "z.9.pkl", "wb") as f:
+        pickle.dump(np.random.default_rng(0).normal(size=(500, 8)).astype(np.float32), f)
+
+    runs = analysis_runs([4, 9], [10, 20])
+    analyze_all(job, str(cryodrgn_output), runs, 3.0, 2)
+    assert len(job.plots) == 4 * 3
+
+    analysis_output = str(job.local_dir / "cryodrgn_analyze_9_k10")
+    assert generate_volumes(job, str(cryodrgn_output), 9, analysis_output, 3.0) == ["pc1", "pc2", "kmeans10"]
+    assert np.loadtxt(f"{analysis_output}/pc1/z_values.txt").shape == (TRAJECTORY_POINTS, 8)
+    assert len(os.listdir(f"{analysis_output}/kmeans10")) == 1 + 10
+
+    job.add_output("volume", "series_pc1", slots=["series"])
+    assert save_volume_series(job, "series_pc1", f"{analysis_output}/pc1", 3.0)
+    assert job.load_output("series_pc1")["series/series_length"][0] == TRAJECTORY_POINTS
+    # Only the plots of the other analyses are kept
+    assert not save_volume_series(job, "series_pc2", str(job.local_dir / "cryodrgn_analyze_4_k10" / "pc2"), 3.0)
+
+
+def test_pc_trajectories():
+    rng = np.random.default_rng(0)
+    t = rng.normal(0, 5, 2000)
+    z = np.outer(t, [0, -1, 0]) + np.outer(rng.normal(0, 1, 2000), [1, 0, 0]) + rng.normal(0, 0.01, (2000, 3)) + 2
+    pc1, pc2 = pc_trajectories(z)
+    mean = z.mean(axis=0)
+
+    # The first PC traverses the widest direction from its 5th to its 95th percentile (sign: largest loading positive)
+    assert np.allclose(pc1[:, 1], np.linspace(*np.percentile(z[:, 1], (5, 95)), TRAJECTORY_POINTS), atol=0.05)
+    assert np.allclose(pc1[:, [0, 2]], mean[[0, 2]], atol=0.05)
+    assert np.allclose(pc2[:, [1, 2]], mean[[1, 2]], atol=0.05)
+    assert pc2[0, 0] < pc2[-1, 0]
@@ -0,0 +1,35 @@
+import pickle
+
+import numpy as np
+import pytest
+from fake_cryosparc import FakeCryoSPARC
+from synthetic import synthetic_micrographs, synthetic_particles
+
+from cryodrgn_preprocess import preprocess, select_random
+
+
+def cryodrgn_select_random(n_total, n, seed=0):
+    """Subset as ``cryodrgn_utils select_random`` (cryodrgn 4.3.1) draws it."""
+    np.random.seed(seed)
+    return np.array(sorted(np.random.choice(n_total, n, replace=False)))
+
+
+@pytest.mark.parametrize("n_total, n, seed", [(1000, 100, 0), (1000, 100, 7), (50, 50, 0)])
+def test_select_random_matches_cryodrgn(n_total, n, seed):
+    assert np.array_equal(select_random(n_total, n, seed), cryodrgn_select_random(n_total, n, seed))
+
+
+def test_subset_cached_and_reproducible(tmp_path):
+    project = FakeCryoSPARC(str(tmp_path)).create_project("P1")
+    particles_path = str(tmp_path / "particles.cs")
+    synthetic_particles(synthetic_micrographs(10), 1000, np.random.default_rng(0)).save(particles_path)
+
+    subsets = []
+    for _ in range(2):
+        job = project.create_external_job("W1")
+        preprocess(job, particles_path, 256, 1000, 100, str(tmp_path / "cache"))
+        with open(job.local_dir / "ind100.pkl", "rb") as f:
+            subsets.append(pickle.load(f))
+    assert np.array_equal(subsets[0], subsets[1])
+    assert np.array_equal(subsets[0], cryodrgn_select_random(1000, 100))
+    assert "(3 of 3 from cache" in job.logs[-1]
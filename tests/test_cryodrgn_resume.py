@@ -0,0 +1,55 @@
+import pytest
+
+from cryodrgn_resume import (
+    has_preprocessed,
+    latest_checkpoint,
+    preprocessed_files,
+    resume_training,
+)
+
+
+def preempted_run(output_dir, weights, latents):
+    """Fake cryodrgn training output of a run stopped after writing ``weights.N.pkl`` and ``z.N.pkl`` of some epochs."""
+    output_dir.mkdir(exist_ok=True)
+    for epoch in weights:
+        (output_dir / f"weights.{epoch}.pkl").write_bytes(b"weights")
+    for epoch in latents:
+        (output_dir / f"z.{epoch}.pkl").write_bytes(b"z")
+    (output_dir / "run.log").write_text("Epoch 1/10\n")
+    return output_dir
+
+
+def test_no_checkpoint(tmp_path):
+    assert latest_checkpoint(tmp_path / "cryodrgn") is None
+    assert resume_training(tmp_path / "cryodrgn", 10) == (None, "", False)
+    assert latest_checkpoint(preempted_run(tmp_path / "cryodrgn", [], [])) is None
+
+
+def test_checkpoint_without_latents_is_skipped(tmp_path):
+    # Preempted while saving epoch 4: its weights were written but not its latents
+    output = preempted_run(tmp_path / "cryodrgn", range(5), range(4))
+    assert latest_checkpoint(output) == 3
+    assert resume_training(output, 10) == (3, " --load cryodrgn/weights.3.pkl", False)
+
+
+def test_checkpoints_compare_numerically(tmp_path):
+    output = preempted_run(tmp_path / "cryodrgn", [2, 9, 10], [2, 9, 10])
+    assert latest_checkpoint(output) == 10
+
+
+@pytest.mark.parametrize("epochs", [10, 8])
+def test_all_epochs_done_skips_training(tmp_path, epochs):
+    output = preempted_run(tmp_path / "cryodrgn", range(10), range(10))
+    last_epoch, load, done = resume_training(output, epochs)
+    assert last_epoch == 9
+    assert load == " --load cryodrgn/weights.9.pkl"
+    assert done
+
+
+def test_pickles_kept_on_resume(tmp_path):
+    assert not has_preprocessed(tmp_path, 1000)
+    for name in preprocessed_files(1000):
+        (tmp_path / name).write_bytes(b"pickle")
+    assert has_preprocessed(tmp_path, 1000)
+    # Another subset size needs its own index file
+    assert not has_preprocessed(tmp_path, 500)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from synthetic import synthetic_micrographs, synthetic_picks
+
+from annotations import pixel_coordinates
+from dedup import deduplicate, neighbour_pairs, suppress
+
+
+def brute_force_pairs(groups, x, y, radius):
+    """All ``(i, j)`` with ``i < j`` in the same group closer than ``radius``, by comparing every pair."""
+    i, j = np.triu_indices(len(x), 1)
+    close = (groups[i] == groups[j]) & ((x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2 < radius**2)
+    return set(zip(i[close].tolist(), j[close].tolist()))
+
+
+def brute_force_keep(groups, x, y, scores, radius):
+    """Greedy non-maximum suppression one point at a time, from the highest score down (ties to the lower index)."""
+    keep = np.zeros(len(scores), dtype=bool)
+    for i in np.lexsort((np.arange(len(scores)), -scores)):
+        kept = np.flatnonzero(keep & (groups == groups[i]))
+        keep[i] = not np.any((x[kept] - x[i]) ** 2 + (y[kept] - y[i]) ** 2 < radius**2)
+    return keep
+
+
+def random_case(rng, n):
+    """Points in a few groups, partly at negative coordinates, with integer scores so that ties are common."""
+    groups = rng.integers(0, 5, n)
+    x = rng.uniform(0, 400, n)
+    y = rng.uniform(-50, 300, n)
+    scores = rng.integers(0, 10, n).astype(np.float32)
+    return groups, x, y, scores, rng.uniform(3, 40)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    groups, x, y, scores, radius = random_case(rng, int(rng.integers(0, 300)))
+    first, second = neighbour_pairs(groups, x, y, radius)
+    pairs = set(zip(np.minimum(first, second).tolist(), np.maximum(first, second).tolist()))
+    assert len(pairs) == len(first)
+    assert pairs == brute_force_pairs(groups, x, y, radius)
+    assert np.array_equal(suppress(scores, (first, second)), brute_force_keep(groups, x, y, scores, radius))
+
+
+def test_chain():
+    # Only the middle point is close to the others: it suppresses both if best, else it is suppressed and both are kept
+    x = np.array([0.0, 9.0, 18.0])
+    scores = np.array([0.5, 0.9, 0.4])
+    pairs = neighbour_pairs(np.zeros(3, dtype=int), x, np.zeros(3), 10)
+    assert suppress(scores, pairs).tolist() == [False, True, False]
+    assert suppress(np.array([0.9, 0.5, 0.4]), pairs).tolist() == [True, False, True]
+
+
+def test_deduplicate():
+    rng = np.random.default_rng(0)
+    particles = synthetic_picks(synthetic_micrographs(3), 2000, rng)
+    keep = deduplicate(particles, 64)
+    x, y = pixel_coordinates(particles)
+    _, groups = np.unique(particles["location/micrograph_uid"], return_inverse=True)
+    expected = brute_force_keep(groups.reshape(-1), np.asarray(x, float), np.asarray(y, float), particles["pick_stats/ncc_score"], 64)
+    assert np.array_equal(keep, np.flatnonzero(expected))
+    assert 0 < len(keep) < len(particles)
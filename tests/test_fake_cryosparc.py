@@ -0,0 +1,10 @@
+from fake_cryosparc import FakeCryoSPARC
+
+
+def test_new_jobs_keep_upstream_jobs(tmp_path):
+    project = FakeCryoSPARC(str(tmp_path)).create_project("P1")
+    upstream = project.add_job("J2")
+    job = project.create_external_job("W1")
+    other = project.create_external_job("W1")
+    assert len({upstream.uid, job.uid, other.uid}) == 3
+    assert project.jobs["J2"] is upstream
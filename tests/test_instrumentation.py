@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from instrumentation import Profile, aggregate, count_api_calls, snapshot
+
+
+def test_counts_api_requests():
+    httpx = pytest.importorskip("httpx")
+    api = pytest.importorskip("cryosparc.api")
+    namespace = api.APINamespace(httpx.Client(base_url="http://cryosparc", transport=httpx.MockTransport(lambda request: httpx.Response(200, json={}))))
+    count_api_calls()
+    count_api_calls()
+
+    before = snapshot()["api"]
+    with namespace._request("GET", "/health"):
+        pass
+    with namespace._request_stream("GET", "/files"):
+        pass
+    assert snapshot()["api"] - before == 2
+
+
+def test_reports_kept_per_run(tmp_path):
+    reports = []
+    # A run and its resumed run an hour later
+    for started in [1_700_000_000, 1_700_003_600]:
+        profile = Profile("script")
+        profile.started = started
+        with profile.stage("setup"):
+            pass
+        reports.append(profile.write(str(tmp_path)))
+
+    assert len(set(reports)) == 2
+    assert len(list(tmp_path.glob("instrumentation.*.json"))) == len(list(tmp_path.glob("instrumentation.*.csv"))) == 2
+    loaded = []
+    for path in reports:
+        with open(path) as f:
+            loaded.append(json.load(f))
+    assert aggregate(loaded)[0][:3] == ("script", "setup", 2)
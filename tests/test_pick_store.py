@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from bench_pick_import import legacy_import
+from cryosparc.dataset import Dataset
+from fake_cryosparc import FakeCryoSPARC
+from synthetic import PICK_FIELDS, synthetic_locations, synthetic_micrographs
+
+import crYOLO_repick
+from pick_store import PickStore, PickStoreWriter, pick_store_path
+
+
+class Job:
+    def alloc_output(self, name, alloc=0):
+        return Dataset.allocate(alloc, PICK_FIELDS)
+
+
+def chunk_locations(micrographs, chunks, picks_per_chunk, rng):
+    """crYOLO picks of consecutive micrograph chunks, one STAR record array per chunk (some chunks empty)."""
+    bounds = np.linspace(0, len(micrographs), chunks + 1).astype(int)
+    return [synthetic_locations(micrographs.take(np.arange(start, stop)), picks_per_chunk if i % 3 else 0, rng) for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
+@pytest.fixture
+def micrographs():
+    return synthetic_micrographs(30)
+
+
+def test_offsets_after_batches(tmp_path, micrographs):
+    batches = chunk_locations(micrographs, 6, 200, np.random.default_rng(0))
+    locations = np.concatenate(batches)
+    with PickStoreWriter(str(tmp_path), micrographs) as writer:
+        for batch in batches:
+            writer.append(batch)
+            writer.commit()
+            assert len(PickStore(str(tmp_path))) == writer.count
+
+    store = PickStore(str(tmp_path))
+    assert len(store) == len(locations) == 4 * 200
+    assert store.offsets[0] == 0 and store.offsets[-1] == len(store)
+    names = [path.split("/")[-1] for path in micrographs["micrograph_blob/path"]]
+    for i, name in enumerate(names):
+        on_micrograph = locations[locations["rlnMicrographName"] == name]
+        picks = store.micrograph(i)
+        assert store.offsets[i + 1] - store.offsets[i] == len(on_micrograph)
+        assert np.array_equal(picks["x"], on_micrograph["rlnCoordinateX"].astype(np.float32))
+        assert np.array_equal(picks["score"], on_micrograph["rlnAutopickFigureOfMerit"].astype(np.float32))
+        assert np.all(picks["mic"] == i)
+
+
+def test_uncommitted_picks_not_visible(tmp_path, micrographs):
+    with PickStoreWriter(str(tmp_path), micrographs) as writer:
+        writer.append(synthetic_locations(micrographs, 100, np.random.default_rng(0)))
+        assert len(PickStore(str(tmp_path))) == 0
+    assert len(PickStore(str(tmp_path))) == 100
+
+
+def test_out_of_order_batch(tmp_path, micrographs):
+    rng = np.random.default_rng(0)
+    later = synthetic_locations(micrographs.take(np.arange(15, 30)), 100, rng)
+    earlier = synthetic_locations(micrographs.take(np.arange(0, 15)), 100, rng)
+    with PickStoreWriter(str(tmp_path), micrographs) as writer:
+        writer.append(later)
+        with pytest.raises(ValueError):
+            writer.append(earlier)
+    assert len(PickStore(str(tmp_path))) == 100
+
+
+def test_empty_store(tmp_path, micrographs):
+    with PickStoreWriter(str(tmp_path), micrographs) as writer:
+        writer.append(None)
+    store = PickStore(str(tmp_path))
+    assert len(store) == 0
+    assert len(store.micrograph(5)["x"]) == 0
+    assert len(store.to_particles(Job(), 0.5)) == 0
+
+
+@pytest.mark.parametrize("threshold", [None, 0.0, 0.3, 0.9, 1.1])
+def test_to_particles_matches_per_micrograph_import(tmp_path, micrographs, threshold):
+    locations = synthetic_locations(micrographs, 3000, np.random.default_rng(0))
+    with PickStoreWriter(str(tmp_path), micrographs) as writer:
+        writer.append(locations)
+    particles = PickStore(str(tmp_path)).to_particles(Job(), threshold)
+
+    expected = legacy_import(Job(), micrographs, locations if threshold is None else locations[locations["rlnAutopickFigureOfMerit"] >= threshold])
+    assert len(particles) == len(expected)
+    for field in ["location/micrograph_uid", "location/micrograph_path", "location/micrograph_shape"]:
+        assert np.array_equal(particles[field], expected[field])
+    for field in ["location/center_x_frac", "location/center_y_frac", "pick_stats/ncc_score", "pick_stats/power"]:
+        assert np.allclose(particles[field], expected[field], atol=1e-6)
+
+
+def test_repick(tmp_path, monkeypatch):
+    cs = FakeCryoSPARC(str(tmp_path))
+    project = cs.create_project("P1")
+    micrographs = synthetic_micrographs(10)
+    locations = synthetic_locations(micrographs, 1000, np.random.default_rng(0))
+    cryolo_job = project.add_job()
+    with PickStoreWriter(pick_store_path(cryolo_job), micrographs) as writer:
+        writer.append(locations)
+    monkeypatch.setattr(crYOLO_repick, "connect", lambda baseport: cs)
+
+    job = crYOLO_repick.run(SimpleNamespace(project="P1", workspace="W1", cryolo_job_id=cryolo_job.uid, threshold=0.7, title=None, baseport=39000))
+    assert job.status == "completed"
+    assert len(job.load_output("predicted_particles")) == np.count_nonzero(locations["rlnAutopickFigureOfMerit"].astype(np.float32) >= 0.7)
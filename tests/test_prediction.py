@@ -0,0 +1,76 @@
+import os
+import sys
+
+import pytest
+from fake_cryosparc import FakeCryoSPARC
+
+from prediction import CHUNK_DONE_FILE, predict_on_gpus, stream_predictions
+
+FAKE_PREDICT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fake_cryolo_predict.py")
+
+
+def predict_command(input_folder, output_folder, gpu):
+    return [sys.executable, FAKE_PREDICT, "-i", input_folder, "-o", output_folder, "-g", str(gpu), "--picks", "10", "-t", "0"]
+
+
+@pytest.fixture
+def job(tmp_path):
+    """Fake external job with 10 micrographs of different sizes in ``full_data``."""
+    job = FakeCryoSPARC(str(tmp_path)).create_project("P1").create_external_job("W1")
+    os.makedirs(job.local_dir / "full_data")
+    for i in range(10):
+        with open(job.local_dir / "full_data" / f"mic_{i:02d}.mrc", "wb") as f:
+            f.truncate(1000 * (i + 1))
+    return job
+
+
+def names(job):
+    return sorted(os.listdir(job.local_dir / "full_data"))
+
+
+@pytest.mark.parametrize("gpus", [[0], [0, 1]])
+def test_predict_on_gpus(job, gpus):
+    star_paths = predict_on_gpus(job, names(job), gpus, predict_command, "full_data", "boxfiles")
+    assert len(star_paths) == len(gpus)
+    assert all(os.path.exists(path) for path in star_paths)
+    # Sharded runs log a checkpoint before predicting, a single GPU run checkpoints its subprocess instead
+    assert ("checkpoint" in job.logs) == (len(gpus) > 1)
+
+
+def test_stream_predictions_resumes(job):
+    picks = dict(stream_predictions(job, names(job), 4, predict_command, gpus=[0, 1]))
+    assert sorted(picks) == [0, 1, 2]
+    assert sum(len(chunk) for chunk in picks.values()) == 10 * 10
+    assert os.path.exists(job.local_dir / "boxfiles" / "chunk_002" / CHUNK_DONE_FILE)
+
+    # A second run only reads the finished chunks
+    calls = job.api_log.summary()["subprocess"]["calls"]
+    resumed = dict(stream_predictions(job, names(job), 4, predict_command, gpus=[0, 1]))
+    assert job.api_log.summary()["subprocess"]["calls"] == calls
+    assert [len(resumed[i]) for i in resumed] == [len(picks[i]) for i in picks]
+
+
+def test_resume_with_fewer_gpus(job):
+    # 12 micrographs of the same size, so that the two and three GPU splits of the second chunk overlap partially
+    for i in range(12):
+        with open(job.local_dir / "full_data" / f"mic_{i:02d}.mrc", "wb") as f:
+            f.truncate(1000)
+
+    # The first run crashes in the second chunk, after two of its three shards were predicted
+    def crashing_command(input_folder, output_folder, gpu):
+        if input_folder.startswith("shards/chunks/chunk_001") and gpu == 2:
+            return [sys.executable, "-c", "raise SystemExit(1)"]
+        return predict_command(input_folder, output_folder, gpu)
+
+    with pytest.raises(RuntimeError):
+        list(stream_predictions(job, names(job), 6, crashing_command, gpus=[0, 1, 2]))
+    assert os.path.isdir(job.local_dir / "boxfiles" / "chunk_001" / "gpu_0")
+
+    # Resumed on two GPUs: the shard folders are rebuilt and the old shard outputs are not read
+    picks = dict(stream_predictions(job, names(job), 6, predict_command, gpus=[0, 1]))
+    assert sum(len(chunk) for chunk in picks.values()) == 12 * 10
+    assert sorted(os.listdir(job.local_dir / "boxfiles" / "chunk_001")) == [CHUNK_DONE_FILE, "gpu_0", "gpu_1"]
+    shards = [sorted(os.listdir(job.local_dir / "shards" / "chunks" / "chunk_001" / f"gpu_{gpu}")) for gpu in (0, 1)]
+    assert sorted(shards[0] + shards[1]) == names(job)[6:]
+    resumed = dict(stream_predictions(job, names(job), 6, predict_command, gpus=[0, 1, 2]))
+    assert sum(len(chunk) for chunk in resumed.values()) == 12 * 10
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import numpy as np
+
+from filter_cache import FilterCache
+
+
+def particle_counts(micrograph_paths, particle_paths):
+    """Number of particles on each of ``micrograph_paths``, given the micrograph path of every particle."""
+    unique_paths, counts = np.unique(np.asarray(particle_paths).astype(str), return_counts=True)
+    lookup = dict(zip(unique_paths, counts))
+    return np.array([lookup.get(path, 0) for path in np.asarray(micrograph_paths).astype(str)], dtype=np.int64)
+
+
+def representative_subset(counts, n):
+    """
+    Sorted indices of at most ``n`` micrographs with particles, spread evenly over the particle count distribution
+    (from the emptiest to the most crowded micrograph), so a smaller training set keeps the range of densities.
+    """
+    picked = np.flatnonzero(counts)
+    if len(picked) <= n:
+        return picked
+    order = picked[np.argsort(counts[picked], kind="stable")]
+    return np.sort(order[np.linspace(0, len(order) - 1, n).round().astype(int)])
+
+
+def bin_image(source, target, factor):
+    """
+    Write ``source`` binned by ``factor`` (mean of ``factor`` x ``factor`` pixel blocks, edges cropped) to ``target``
+    as float32 MRC. Written to a temporary file first, so an interrupted run never leaves a partial image. Needs the
+    ``mrcfile`` package (installed with crYOLO).
+    """
+    try:
+        import mrcfile
+    except ImportError:
+        raise ImportError("Binning training micrographs needs the mrcfile package (pip install mrcfile)")
+    with mrcfile.mmap(source, mode="r", permissive=True) as mrc:
+        data = mrc.data.reshape(mrc.data.shape[-2:])
+        voxel_size = float(mrc.voxel_size.x)
+        height, width = data.shape[-2] // factor, data.shape[-1] // factor
+        binned = data[: height * factor, : width * factor].reshape(height, factor, width, factor).mean(axis=(1, 3), dtype=np.float32)
+    tmp_path = f"{target}.tmp"
+    with mrcfile.new(tmp_path, overwrite=True) as mrc:
+        mrc.set_data(binned)
+        mrc.voxel_size = voxel_size * factor
+    os.replace(tmp_path, target)
+    return os.path.getsize(target)
+
+
+def _bin_entry(task):
+    return bin_image(*task)
+
+
+def bin_micrographs(job, source_paths, folder, factor, cache_dir, max_bytes, workers=None):
+    """
+    Bin the micrographs in ``source_paths`` (absolute paths) by ``factor`` with a process pool and link them into
+    ``folder`` of the job, by basename.
+
+    Binned images are kept in ``cache_dir`` (keyed like ``FilterCache`` entries on path, modification time and factor),
+    so later training runs on the same micrographs only link them. Least recently used entries are evicted above
+    ``max_bytes``, keeping the images of this run. Returns the number of micrographs binned in this run.
+    """
+    tic = time()
+    cache = FilterCache(cache_dir, str(job.dir()), source_paths, ("BIN", factor), max_bytes)
+    tasks = [(source, cache.entries[os.path.basename(source)], factor) for source in source_paths]
+    missing = [task for task in tasks if not os.path.exists(task[1])]
+    if missing:
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(_bin_entry, missing, chunksize=4))
+
+    folder_dir = os.path.join(str(job.dir()), folder)
+    os.makedirs(folder_dir, exist_ok=True)
+    now = time()
+    for source, entry, _ in tasks:
+        target = os.path.join(folder_dir, os.path.basename(source))
+        if not os.path.lexists(target):
+            os.symlink(entry, target)
+        os.utime(entry, (now, now))
+    # The entries of this run were used last and are never evicted, even if they alone exceed max_bytes
+    cache.max_bytes = max(max_bytes, sum(os.path.getsize(entry) for _, entry, _ in tasks))
+    freed = cache.evict()
+    job.log(f"Binned {len(missing)} training micrographs by {factor} ({len(tasks) - len(missing)} from cache {cache_dir}, {freed / 1e9:.1f} GB evicted) in {time() - tic:.1f}s")
+    return len(missing)